@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+""" Serial against parallel rendering of many control plots
+
+Usage: python bench_batch.py [number of plots]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import b2plot
+
+
+def main(n_plots=100, n_rows=10**5):
+    rng = np.random.RandomState(0)
+    df = pd.DataFrame(rng.normal(size=(n_rows, n_plots)), columns=['var%d' % i for i in range(n_plots)])
+
+    with tempfile.TemporaryDirectory() as out:
+        jobs = [{'column': c, 'bins': 50, 'path': os.path.join(out, c + '.png'), 'style': {'color': 0}}
+                for c in df.columns]
+        for n_workers in sorted({1, 2, os.cpu_count()}):
+            start = time.perf_counter()
+            timing = b2plot.render_batch(df, jobs, n_workers=n_workers)
+            wall = time.perf_counter() - start
+            print("%2d workers: %6.2f s, %5.1f plots/s, per plot: plot %.3f s, save %.3f s" % (
+                n_workers, wall, n_plots / wall, np.mean([t['plot'] for t in timing]),
+                np.mean([t['save'] for t in timing])))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
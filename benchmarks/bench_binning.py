@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+""" Benchmark of the binning kernel
+
+Compares b2plot.binning.fill against np.histogram for equidistant and variable bin edges, with and without weights,
+and the threaded fill against the serial one.
+
+Usage:
+    python bench_binning.py [max_exponent]
+
+By default 10^6, 10^7 and 10^8 entries are filled, 10^8 entries need about 2 GB of memory.
+
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+from b2plot.binning import fill
+
+
+def timed(func, repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    max_exponent = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    rng = np.random.default_rng(42)
+
+    print("%-10s %-9s %-8s %12s %12s %8s" % ("entries", "edges", "weights", "np.histogram", "fill", "speedup"))
+    for exponent in range(6, max_exponent + 1):
+        n = 10**exponent
+        data = rng.normal(0, 1, n)
+        weights = rng.uniform(0, 2, n)
+        repeat = 3 if exponent < 8 else 1
+
+        for edges_name, edges in [("uniform", np.linspace(-3, 3, 101)),
+                                  ("variable", np.percentile(data[:10000], np.linspace(0, 100, 101)))]:
+            for w in [None, weights]:
+                t_np = timed(lambda: np.histogram(data, edges, weights=w), repeat)
+                t_fill = timed(lambda: fill(data, edges, w), repeat)
+                print("10^%-7d %-9s %-8s %10.3f s %10.3f s %7.1fx" %
+                      (exponent, edges_name, "no" if w is None else "yes", t_np, t_fill, t_np / t_fill))
+
+    n_threads = os.cpu_count()
+    print("\n%-10s %-9s %10s %12s %8s" % ("entries", "threads", "serial", "threaded", "speedup"))
+    for exponent in range(6, max_exponent + 1):
+        data = rng.normal(0, 1, 10**exponent)
+        weights = rng.uniform(0, 2, 10**exponent)
+        edges = np.linspace(-3, 3, 101)
+        t_serial = timed(lambda: fill(data, edges, weights, n_threads=1))
+        t_threads = timed(lambda: fill(data, edges, weights, n_threads=n_threads))
+        print("10^%-7d %-9d %8.3f s %10.3f s %7.1fx" % (exponent, n_threads, t_serial, t_threads, t_serial / t_threads))
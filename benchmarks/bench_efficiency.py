@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+""" Benchmark of the efficiency calculation
+
+Compares the vectorized clopper pearson intervals used by divide_efficiency against the previous per bin loop
+over exact_CI on a 2D efficiency map.
+
+"""
+import time
+
+import numpy as np
+
+from b2plot.analysis import divide_efficiency, exact_CI
+
+
+def divide_efficiency_loop(n_nom, n_denom, confidence=0.683):
+    """ Reference implementation, calls exact_CI once per bin
+    """
+    shape = np.shape(n_nom)
+    rat, err_down, err_up = [], [], []
+    for passes, counts in zip(n_nom.flatten(), n_denom.flatten()):
+        bin_ratio = exact_CI(passes, counts, conf=confidence)
+        rat.append(bin_ratio[0])
+        err_down.append(bin_ratio[1])
+        err_up.append(bin_ratio[2])
+    return np.reshape(rat, shape), (np.reshape(err_down, shape), np.reshape(err_up, shape))
+
+
+def timed(func, *args, repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(42)
+    for nbins in [20, 50, 100, 200]:
+        n_denom = rng.poisson(50, size=(nbins, nbins)).astype(float)
+        n_nom = rng.binomial(n_denom.astype(int), 0.7).astype(float)
+
+        t_loop, res_loop = timed(divide_efficiency_loop, n_nom, n_denom, repeat=1)
+        t_vec, res_vec = timed(divide_efficiency, n_nom, n_denom)
+
+        assert np.allclose(res_loop[0], res_vec[0])
+        assert np.allclose(res_loop[1], res_vec[1])
+        print("%4dx%-4d bins: loop %8.3f s  vectorized %8.4f s  speedup %6.0fx" %
+              (nbins, nbins, t_loop, t_vec, t_loop / t_vec))
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+""" Benchmark of the ROC AUC
+
+Compares the exact and the binned AUC of b2plot.analysis against sklearn.metrics.roc_auc_score, if it is installed.
+
+Usage: python bench_roc.py [number of events]
+"""
+import sys
+import time
+
+import numpy as np
+
+from b2plot.analysis import roc_auc, binned_roc_auc
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+if __name__ == "__main__":
+    n = int(float(sys.argv[1])) if len(sys.argv) > 1 else 10**8
+    rng = np.random.default_rng(42)
+    mask = rng.uniform(size=n) < 0.3
+    # rounded, so that there are many ties
+    x = np.round(rng.normal(size=n) + mask, 3)
+    weights = rng.uniform(0.5, 1.5, size=n)
+
+    for label, w in [("unweighted", None), ("weighted", weights)]:
+        t_exact, exact = timed(roc_auc, x, mask, w)
+        t_binned, (binned, error) = timed(binned_roc_auc, x, mask, w)
+        print("%-10s exact  %.8f %8.2f s" % (label, exact, t_exact))
+        print("%-10s binned %.8f %8.2f s  deviation %.1e  bound %.1e" % (
+            label, binned, t_binned, abs(binned - exact), error))
+        try:
+            from sklearn.metrics import roc_auc_score
+        except ImportError:
+            continue
+        # sample_weight is keyword-only
+        t_sklearn, reference = timed(lambda: roc_auc_score(mask, x, sample_weight=w))
+        print("%-10s sklearn %.8f %7.2f s  deviation %.1e" % (label, reference, t_sklearn, abs(reference - exact)))
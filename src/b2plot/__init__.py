@@ -2,12 +2,18 @@ import pkg_resources
 
 __version__ = pkg_resources.get_distribution(__name__).version
 from .functions import xlim, save, save_adjust
-from .histogram import hist, errorbar, stacked, to_stack, errorhist, set_xaxis, bc
+from .histogram import hist, errorbar, stacked, to_stack, errorhist, set_xaxis, bc, hist_from_counts, stacked_from_counts
+from .accumulator import HistAccumulator
+from .sources import ParquetColumn
+from .quantiles import QuantileSketch, WindowedQuantileSketch
+from .cache import enable_cache, disable_cache, cache_info
+from .binning import set_threads
+from .batch import render_batch
 from .analysis import sig_bkg_plot
-from .helpers import xaxis, nf, figure
+from .helpers import xaxis, nf, figure, defer, render
 from .decorations import draw_y_label, decorate, expand, watermark, lumi, labels, text
 from .colors import cm, b2helix
-from .correlations import flat_correlation, flat_corr_matrix
+from .correlations import flat_correlation, flat_corr_matrix, flat_corr_tensor, flat_corr_image, CorrelationAccumulator, correlation_matrix
 from .mva import plot_features, mva_input_plot
 
 print("For optimal usage set `plt.style.use('belle2')`")
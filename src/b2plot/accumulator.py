@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Histograms which are filled chunk by chunk.
+
+The full sample never has to be in memory, only the bin contents are kept.
+
+"""
+
+import numpy as np
+import pandas as pd
+
+from .helpers import TheManager
+from .binning import fill
+
+
+class HistAccumulator:
+    """ Histogram with fixed bin edges which is filled chunk by chunk.
+
+    The sum of weights and the sum of squared weights are tracked for each bin, so the memory usage only depends on
+    the number of bins and not on the number of rows. A finished accumulator can be drawn with hist, errorhist
+    and stacked (as a list of accumulators).
+
+    Args:
+        bins: bin edges, or number of bins if range is given. If None, the current x-axis of the manager is used.
+        range: (low, high) tuple, only used together with an integer number of bins.
+
+    Examples:
+        >>> acc = HistAccumulator(np.linspace(0, 1, 51))
+        >>> for chunk in pd.read_csv("ntuple.csv", chunksize=10**6):
+        ...     acc.fill(chunk, column='x', weights='w')
+        >>> b2plot.hist(acc)
+
+    """
+
+    def __init__(self, bins=None, range=None):
+        if bins is None and range is None:
+            bins = TheManager.Instance().get_x_axis()
+            assert bins is not None, "Please provide bins, no x-axis is set yet"
+        if range is not None:
+            assert bins is not None and np.ndim(bins) == 0, "Please provide the number of bins together with range"
+            bins = np.linspace(range[0], range[1], int(bins) + 1)
+
+        self.edges = np.asarray(bins, dtype=float)
+        assert self.edges.ndim == 1 and len(self.edges) > 1, "Please provide at least two bin edges"
+        self.sumw = np.zeros(len(self.edges) - 1)
+        self.sumw2 = np.zeros(len(self.edges) - 1)
+        self.entries = 0
+
+    def fill(self, data, weights=None, column=None, n_threads=None):
+        """ Add a chunk, or an iterable of chunks, to the histogram
+
+        Args:
+            data: array, Series or DataFrame chunk, or an iterable (e.g. generator, pandas chunk reader) of those.
+                The iterable can also yield (data, weights) tuples.
+            weights: weights for data, for DataFrame chunks this can be a column name
+            column: column name, required if DataFrame chunks are given
+            n_threads: (optional) number of threads per chunk, by default the setting of set_threads is used
+
+        Returns:
+            self
+
+        """
+        if not _is_chunk(data):
+            for chunk in data:
+                if isinstance(chunk, tuple):
+                    chunk, chunk_weights = chunk
+                else:
+                    chunk_weights = weights
+                self._fill_chunk(chunk, chunk_weights, column, n_threads)
+            return self
+
+        self._fill_chunk(data, weights, column, n_threads)
+        return self
+
+    def _fill_chunk(self, data, weights=None, column=None, n_threads=None):
+        if isinstance(data, pd.DataFrame):
+            assert column is not None, "Please provide column"
+            if isinstance(weights, str):
+                weights = data[weights]
+            data = data[column]
+
+        data = np.asarray(data)
+        if weights is not None:
+            weights = np.asarray(weights, dtype=float)
+            assert len(weights) == len(data), "Weights and data length does not match"
+
+        sumw, sumw2, _ = fill(data, self.edges, weights, n_threads)
+        self.sumw += sumw
+        self.sumw2 += sumw2
+        self.entries += len(data)
+
+    def __iadd__(self, other):
+        assert np.array_equal(self.edges, other.edges), "Only histograms with the same binning can be added"
+        self.sumw += other.sumw
+        self.sumw2 += other.sumw2
+        self.entries += other.entries
+        return self
+
+    @property
+    def counts(self):
+        return self.sumw
+
+    @property
+    def errors(self):
+        return np.sqrt(self.sumw2)
+
+    def bin_centers(self):
+        return (self.edges[1:] + self.edges[:-1]) / 2.0
+
+
+def _is_chunk(data):
+    """ Tell a single chunk of values from an iterable of chunks
+    """
+    if isinstance(data, list):
+        return len(data) == 0 or not isinstance(data[0], (np.ndarray, pd.Series, pd.DataFrame, tuple))
+    return isinstance(data, (np.ndarray, pd.Series, pd.DataFrame))
@@ -6,13 +6,21 @@ Author:
     - Henrikas Svidras (henrikas.svidras@desy.de)
 
 """
+import os
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
 import b2plot
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import scipy
-from .histogram import _hist_init, to_stack, hist, get_xaxis
+from .histogram import _hist_init, _stack_source, to_stack, hist, get_xaxis, hist_from_counts
+from .accumulator import HistAccumulator
+from .sources import is_parquet_path
 from .functions import xlim
+from .binning import bin_index, fill_grouped
+from .quantiles import percentile_edges
 
 
 def optimal_bin_size(n):
@@ -37,7 +45,7 @@ def plot_flatness(sig, tag, bins=None, ax=None, xrange=None, percent_step=5):
     if ax is None:
         fix, ax = plt.subplots()
 
-    xaxis = _hist_init(sig, bins=bins, xrange=xrange)
+    xaxis = _hist_init(sig, bins=bins, xrange=xrange, ax=ax)
 
     colormap = plt.get_cmap('magma')
     orig, x = np.histogram(sig, bins=xaxis, range=xrange, normed=True, )
@@ -102,14 +110,7 @@ def divide_efficiency(n_nom, n_denom, confidence=0.683, scale=None):
             flattened_n_nom /= scale
             flattened_n_denom /= scale
 
-    rat = []
-    err_down = []
-    err_up = []
-    for passes, counts in zip(flattened_n_nom, flattened_n_denom):
-        bin_ratio = exact_CI(passes, counts, conf=confidence)
-        rat.append(bin_ratio[0])
-        err_down.append(bin_ratio[1])
-        err_up.append(bin_ratio[2])
+    rat, err_down, err_up = exact_CI_array(flattened_n_nom, flattened_n_denom, conf=confidence)
 
     err_down = np.reshape(err_down, shape)
     err_up = np.reshape(err_up, shape)
@@ -122,16 +123,21 @@ def binom_ratio_err(k1,n1, k2,n2):
     """ Confidence interval for a ratio between two confidence intervals.
 
     Args:
-        k1, n1 : for the binomial 1
-        k2, n2 : for the binomial 2
+        k1, n1 : for the binomial 1 (numbers or arrays)
+        k2, n2 : for the binomial 2 (numbers or arrays)
 
     (k1/n1) / (k2/n2)
     Based on the conditional odds ratio ~ p1 / (p1 + p2)
     Implemented following the example on DOI: 10.1101/2020.11.19.20235036 (see section 3.3)
     Which itself is based on: DOI: 10.1177/0962280219886889
+
+    Returns:
+        array of [lower, upper], for array input of shape (2, *np.shape(k1))
     """
+    k1 = np.asarray(k1, dtype=float)
+    k2 = np.asarray(k2, dtype=float)
 
-    _, c0, c1 = exact_CI(k=k1, n=k1+k2)
+    _, c0, c1 = exact_CI_array(k=k1, n=k1+k2)
 
     lower = n2 / n1 * c0 / (1 - c0)
     upper = n2 / n1 * c1 / (1 - c1)
@@ -150,10 +156,10 @@ def divide_ratios(n_nom1, n_denom1, n_nom2, n_denom2, scale1=None, scale2=None):
     Returns:
         ratio, [lower ratio error, upper ratio error]
     """
-    n_nom1 = np.array(n_nom1)
-    n_denom1 = np.array(n_denom1)
-    n_nom2 = np.array(n_nom2)
-    n_denom2 = np.array(n_denom2)
+    n_nom1 = np.array(n_nom1, dtype=float)
+    n_denom1 = np.array(n_denom1, dtype=float)
+    n_nom2 = np.array(n_nom2, dtype=float)
+    n_denom2 = np.array(n_denom2, dtype=float)
 
     shape = np.shape(n_nom1) # It is automatically assumed that histograms are compatible. This will probably fail later if they're not.
 
@@ -171,14 +177,9 @@ def divide_ratios(n_nom1, n_denom1, n_nom2, n_denom2, scale1=None, scale2=None):
         flattened_n_nom2 /= scale2
         flattened_n_denom2 /= scale2
 
-    rat = []
-    err_down = []
-    err_up = []
-    for passes1, counts1, passes2, counts2 in zip(flattened_n_nom1, flattened_n_denom1, flattened_n_nom2, flattened_n_denom2):
-        error = binom_ratio_err(passes1, counts1, passes2, counts2)
-        rat.append((passes1/counts1)/(passes2/counts2))
-        err_down.append(error[0])
-        err_up.append(error[1])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        err_down, err_up = binom_ratio_err(flattened_n_nom1, flattened_n_denom1, flattened_n_nom2, flattened_n_denom2)
+        rat = (flattened_n_nom1/flattened_n_denom1)/(flattened_n_nom2/flattened_n_denom2)
 
     err_down = np.reshape(err_down, shape)
     err_up = np.reshape(err_up, shape)
@@ -219,6 +220,46 @@ def exact_CI(k, n, conf=0.683):
     return result
 
 
+def exact_CI_array(k, n, conf=0.683):
+    """ calculated clopper pearson confidence intervals for whole arrays at once
+
+    Same as exact_CI, but evaluates all bins in a single vectorized call of scipy.stats.beta.ppf.
+    The edge cases n == 0, k == 0 and k == n are handled with masks.
+
+    Args:
+        k: array of passes ("numerator of proportion")
+        n: array of trials ("denominator of proportion"), same shape as k
+        conf: (optional) confidence level, by default 0.683
+
+    Returns:
+        ratio, lower ratio error, upper ratio error as arrays with the shape of k
+    """
+    k = np.asarray(k, dtype=float)
+    n = np.asarray(n, dtype=float)
+
+    assert np.all(k <= n), "denominator found to be smaller than numerator when calculating interval."
+
+    alpha = (1 - conf)
+    empty = n == 0
+    full = k == n
+    none = k == 0
+
+    # The masked bins get dummy shape parameters, their results are overwritten below.
+    n_safe = np.where(empty, 1., n)
+    k_safe = np.where(empty, 0., k)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = np.where(empty, 0., k_safe/n_safe)
+        up = 1 - scipy.stats.beta.ppf(alpha/2, np.where(full, 1., n_safe-k_safe), k_safe+1)
+        down = 1 - scipy.stats.beta.ppf(1-alpha/2, n_safe-k_safe+1, np.where(none, 1., k_safe))
+
+    up = np.where(full, 1., up)
+    down = np.where(none, 0., down)
+    up[empty] = 0.
+    down[empty] = 0.
+
+    return p, p-down, up-p
+
+
 def divhist(h1, h2):
     assert np.mean(h1[1]-h2[1]) < 0.1
     r,re = ratio(h1[0],h2[0], np.mean(h1[2], axis=0),np.mean(h2[2], axis=0) )
@@ -288,12 +329,79 @@ def pur_eff_cont(x, mask):
     return eff, pur 
 
 
-def pur_eff(x, mask, nbins=None, reverse_too=False):
-    """ Plots the distribution x in an equal frequency binning with the purity regarding mask
+class PurityCounts:
+    """ Signal and background counts of x in an equal-frequency binning
+
+    The counts of all bins and both classes are computed with a single bincount over the bin index, no copies of
+    x[mask] and x[~mask] are made. The result can be passed instead of x to pur_eff, fpr_tpr, purity_hist and
+    purity_flatness_proba, which then reuse it.
 
     Args:
         x: Distribution or signal distribution
         mask: Boolean mask or background distribution
+        nbins: Number of equal-frequency bin edges (if None, optimal value is calculated)
+
+    Attributes:
+        edges: bin edges
+        signal, background, total: counts per bin
+
+    """
+
+    def __init__(self, x, mask, nbins=None):
+        if len(pd.unique(mask)) > 2:
+            # if signal and background distribution are given as x and mask
+            x, mask = mask_append(x, mask)
+
+        x = np.asarray(x)
+        mask = np.asarray(mask, dtype=bool)
+        self.nbins = optimal_bin_size(len(x)) if nbins is None else nbins
+
+        finite = np.isfinite(x)
+        if not finite.all():
+            x, mask = x[finite], mask[finite]
+        self.edges = percentile_edges(x, self.nbins)
+
+        # bin index and class folded into one index, entries outside of the edges land in the last pair
+        n = len(self.edges) - 1
+        counts = np.bincount(bin_index(x, self.edges) * 2 + mask, minlength=2 * (n + 1)).reshape(-1, 2)[:n]
+        self.background = counts[:, 0]
+        self.signal = counts[:, 1]
+        self.total = self.signal + self.background
+
+    @classmethod
+    def from_counts(cls, signal, background, edges):
+        """ PurityCounts of already binned signal and background counts
+        """
+        counts = cls.__new__(cls)
+        counts.edges = np.asarray(edges)
+        counts.nbins = len(counts.edges)
+        counts.signal = np.asarray(signal)
+        counts.background = np.asarray(background)
+        counts.total = counts.signal + counts.background
+        return counts
+
+    @property
+    def informative(self):
+        """ False if all edges are equal, i.e. x contains no information
+        """
+        return bool(np.std(self.edges) > 0)
+
+    @property
+    def purity(self):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.signal / self.total
+
+
+def _purity_counts(x, mask, nbins):
+    return x if isinstance(x, PurityCounts) else PurityCounts(x, mask, nbins)
+
+
+def pur_eff(x, mask=None, nbins=None, reverse_too=False):
+    """ Plots the distribution x in an equal frequency binning with the purity regarding mask
+
+    Args:
+        x: Distribution or signal distribution, or PurityCounts
+        mask: Boolean mask or background distribution
         nbins:
         do_plot:
         figsize:
@@ -302,21 +410,12 @@ def pur_eff(x, mask, nbins=None, reverse_too=False):
     Returns:
 
     """
-    if len(pd.unique(mask)) > 2:
-        # if signal and background distribution are given as x and mask
-        x, mask = mask_append(x, mask)
+    counts = _purity_counts(x, mask, nbins)
+    assert counts.informative, "The variable contains no information"
 
-    nbins = optimal_bin_size(len(x)) if nbins is None else nbins
+    y_, y_1, y_0 = counts.total, counts.signal, counts.background
 
-    x = x[np.isfinite(x)]
-    bins = np.percentile(x, np.linspace(0, 100, nbins))
-    assert np.std(bins) > 0, "The variable contains no information"
-
-    y_, _ = np.histogram(x, bins)
-    y_1, _ = np.histogram(x[mask], bins)
-    y_0, _ = np.histogram(x[~mask], bins)
-
-    pur = y_1 / (y_1 + y_0)
+    pur = counts.purity
     ps = np.argsort(pur)
     # pur_err = (pur * (1 - pur)) / (y_)  
 
@@ -347,34 +446,24 @@ def pur_eff(x, mask, nbins=None, reverse_too=False):
     return eff, pur,pur_err, eff_err
 
 
-def fpr_tpr(x, mask, nbins=None):
+def fpr_tpr(x, mask=None, nbins=None):
     """ Plots the distribution x in an equal frequency binning with the purity regarding mask
 
     Args:
-        x: Distribution or signal distribution
+        x: Distribution or signal distribution, or PurityCounts
         mask: Boolean mask or background distribution
         nbins: Number of bins for the internal calculation (if None, optimal value is calculated)
 
     Returns:
         fpr, tpr: False positive rate, True positive rate
     """
-    if len(pd.unique(mask)) > 2:
-        # if signal and background distribution are given as x and mask
-        x, mask = mask_append(x, mask)
-
-    nbins = optimal_bin_size(len(x)) if nbins is None else nbins
-
-    x = x[np.isfinite(x)]
-    bins = np.percentile(x, np.linspace(0, 100, nbins))
-    if np.std(bins) == 0.0:
+    counts = _purity_counts(x, mask, nbins)
+    if not counts.informative:
         print("Warning, no information in feature")
         return np.array([1, 0]), np.array([1, 0])
 
-    y_, _ = np.histogram(x, bins)
-    y_1, _ = np.histogram(x[mask], bins)
-    y_0, _ = np.histogram(x[~mask], bins)
-    with np.errstate(divide="ignore", invalid="ignore"):
-        pur = y_1 / (y_1 + y_0)
+    y_1, y_0 = counts.signal, counts.background
+    pur = counts.purity
 
     ps = np.argsort(pur)
     m = ~np.isnan(pur[ps])
@@ -400,16 +489,150 @@ def purity_auc(x, mask, nbins=None):
     Retruns:
         auc score
     """
-    from sklearn.metrics import auc
-    return auc(*fpr_tpr(x, mask, nbins=None))
+    fpr, tpr = fpr_tpr(x, mask, nbins=nbins)
+    return abs(np.trapz(tpr, fpr))
+
+
+def _roc_input(x, mask, weights=None):
+    """ Signal and background values and weights, entries with non-finite x are dropped
+    """
+    if len(pd.unique(mask)) > 2:
+        # if signal and background distribution are given as x and mask
+        x, mask = mask_append(x, mask)
+    x = np.asarray(x, dtype=float)
+    mask = np.asarray(mask, dtype=bool)
+    assert len(x) == len(mask), "x and mask length does not match"
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float)
+        assert len(weights) == len(x), "Weights and data length does not match"
+
+    finite = np.isfinite(x)
+    if not finite.all():
+        x, mask = x[finite], mask[finite]
+        weights = None if weights is None else weights[finite]
+    return x, mask, weights
+
+
+def roc_curve(x, mask, weights=None):
+    """ Exact ROC curve of x as classifier output, larger values are more signal like
+
+    The data are sorted once. Entries with the same value of x are one point of the curve, so ties give a straight
+    segment instead of an order dependent staircase.
+
+    Args:
+        x: Distribution or signal distribution
+        mask: Boolean mask or background distribution
+        weights: (optional) weight for each entry (of the merged distribution if signal and background are given)
+
+    Returns:
+        fpr, tpr, thresholds: starting at (0, 0) with the threshold inf, one point per distinct value of x in
+        decreasing order
+    """
+    x, mask, weights = _roc_input(x, mask, weights)
+    order = np.argsort(x, kind='stable')[::-1]
+    x = x[order]
+    signal = mask[order].astype(float) if weights is None else np.where(mask[order], weights[order], 0.)
+    background = (~mask[order]).astype(float) if weights is None else np.where(mask[order], 0., weights[order])
+
+    # last entry of each group of equal values
+    last = np.append(np.flatnonzero(x[1:] != x[:-1]), len(x) - 1)
+    tp = np.concatenate(([0.], np.cumsum(signal)[last]))
+    fp = np.concatenate(([0.], np.cumsum(background)[last]))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return fp / fp[-1], tp / tp[-1], np.concatenate(([np.inf], x[last]))
+
+
+def roc_auc(x, mask, weights=None):
+    """ Exact area under the ROC curve of x as classifier output
+
+    The probability that a signal entry has a larger value of x than a background entry, ties count half. Without
+    weights, signal and background are sorted separately and each signal entry looks up the background below it by
+    binary search, so no index array is needed. With weights, all entries are sorted once.
+
+    Args:
+        x: Distribution or signal distribution
+        mask: Boolean mask or background distribution
+        weights: (optional) weight for each entry (of the merged distribution if signal and background are given)
+
+    Returns:
+        auc score, NaN if one of the classes is empty
+
+    Examples:
+        >>> b2plot.analysis.roc_auc(df.BDT, df.isSignal == 1, weights=df.w)
+
+    """
+    x, mask, weights = _roc_input(x, mask, weights)
+    if mask.all() or not mask.any():
+        return np.nan
+    signal, background = x[mask], x[~mask]
+    if weights is None:
+        return _sorted_auc(np.sort(signal), np.sort(background))
+
+    # one sort of all entries, the weights of each group of equal values are summed per class
+    order = np.argsort(x)
+    sorted_x = x[order]
+    first = np.concatenate(([0], np.flatnonzero(sorted_x[1:] != sorted_x[:-1]) + 1))
+    del sorted_x
+    sorted_weights = weights[order]
+    total = np.add.reduceat(sorted_weights, first)
+    sorted_weights *= mask[order]
+    signal = np.add.reduceat(sorted_weights, first)
+    return _grouped_auc(signal, total - signal)
+
+
+def _sorted_auc(signal, background):
+    """ Unweighted AUC from the sorted signal and background values, the sorted queries keep the binary search cache
+    friendly
+    """
+    below = np.searchsorted(background, signal, side='left')
+    equal = np.searchsorted(background, signal, side='right') - below
+    return (np.sum(below) + 0.5 * np.sum(equal)) / (1. * len(signal) * len(background))
 
-    
-def purity_hist(x, mask, nbins=10, do_plot=True, figsize=None, xticks_fontsize=None, ax=None):
-    """ Plots the distribution x in an equal frequency binning with the purity regarding mask
+
+def _grouped_auc(signal, background):
+    """ AUC from the signal and background weights of ordered groups, pairs within a group count half
+    """
+    below = np.cumsum(background) - background
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.dot(signal, below + 0.5 * background) / (np.sum(signal) * np.sum(background))
+
+
+def binned_roc_auc(x, mask, weights=None, nbins=4096, range=None):
+    """ Area under the ROC curve from a fine histogram of signal and background, in a single pass over the data
+
+    Pairs of signal and background entries in different bins are ordered correctly, the ones in the same bin count
+    half. The true contribution of each bin lies between none and all of its pairs, so the deviation from the exact
+    roc_auc is at most half the fraction of pairs which share a bin. This bound is returned with the result, it
+    shrinks with finer bins as long as x does not have large peaks.
 
     Args:
         x: Distribution or signal distribution
         mask: Boolean mask or background distribution
+        weights: (optional) weight for each entry (of the merged distribution if signal and background are given)
+        nbins: number of equidistant bins
+        range: (optional) range of the binning, by default the smallest and largest value of x. Entries outside of
+            the range are dropped.
+
+    Returns:
+        auc, error: auc score and the largest possible deviation from the exact value
+    """
+    x, mask, weights = _roc_input(x, mask, weights)
+    if range is None:
+        range = (np.min(x), np.max(x)) if len(x) else (0, 1)
+    edges = np.linspace(range[0], range[1] if range[1] > range[0] else range[0] + 1, nbins + 1)
+
+    (background, signal), _, _ = fill_grouped(x, mask.astype(np.intp), 2, edges, weights)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        error = 0.5 * np.dot(signal, background) / (np.sum(signal) * np.sum(background))
+    return _grouped_auc(signal, background), error
+
+
+def purity_hist(x, mask=None, nbins=10, do_plot=True, figsize=None, xticks_fontsize=None, ax=None):
+    """ Plots the distribution x in an equal frequency binning with the purity regarding mask
+
+    Args:
+        x: Distribution or signal distribution, or PurityCounts
+        mask: Boolean mask or background distribution
         nbins:
         do_plot:
         figsize:
@@ -419,22 +642,14 @@ def purity_hist(x, mask, nbins=10, do_plot=True, figsize=None, xticks_fontsize=N
     Returns:
 
     """
-    if len(pd.unique(mask)) > 2:
-        # if signal and background distribution are given as x and mask
-        x, mask = mask_append(x, mask)
-
-    x = x[np.isfinite(x)]
-    bins = np.percentile(x, np.linspace(0, 100, nbins))
-    assert np.std(bins) > 0, "The variable contains no information"
+    counts = _purity_counts(x, mask, nbins)
+    assert counts.informative, "The variable contains no information"
 
-    y_, _ = np.histogram(x, bins)
-
-    y_1, _ = np.histogram(x[mask], bins)
-
-    y_0, _ = np.histogram(x[~mask], bins)
+    bins = counts.edges
+    y_, y_1, y_0 = counts.total, counts.signal, counts.background
+    pur = counts.purity
     with np.errstate(divide="ignore", invalid="ignore"):
-        pur = y_1 / (y_1 + y_0)
-        pur_err = (pur * (1 - pur)) / (y_)    
+        pur_err = (pur * (1 - pur)) / (y_)
 
     if do_plot:
         x_ = np.arange(len(y_) + 1)
@@ -442,9 +657,9 @@ def purity_hist(x, mask, nbins=10, do_plot=True, figsize=None, xticks_fontsize=N
 
         if ax is None:
             _, ax = plt.subplots(figsize=figsize)
-        ax.hist(x_[:-1], x_, weights=y_1, alpha=0.8, label='Signal')
-        ax.hist(x_[:-1], x_, weights=y_0, histtype='step', lw=2, label='Background')
-        ax.hist(x_[:-1], x_, weights=y_, histtype='step', color='grey', label='Total')
+        hist_from_counts(y_1, x_, fill=True, fillalpha=0.8, label='Signal', ax=ax)
+        hist_from_counts(y_0, x_, lw=2, label='Background', ax=ax)
+        hist_from_counts(y_, x_, color='grey', label='Total', ax=ax)
 
         ax2 = ax.twinx()
         ax2.errorbar(x_centers, pur, np.sqrt(pur_err), color='black', fmt="o--")
@@ -454,7 +669,6 @@ def purity_hist(x, mask, nbins=10, do_plot=True, figsize=None, xticks_fontsize=N
         ax2.set_ylabel("Purity")
         ax2.set_ylim(0)
 
-        np.append(bins, x.max())
         _ = ax.set_xticks(x_)
         _ = ax.set_xticklabels(['%1.2e' % f for f in bins], rotation=-90, fontfamily='monospace',
                                fontsize=xticks_fontsize)
@@ -464,10 +678,11 @@ def purity_hist(x, mask, nbins=10, do_plot=True, figsize=None, xticks_fontsize=N
 
 
 def flat_bins(x, set=False, nbins=None,  fontsize=None, rotation=-90):
+    """ Equal-frequency binning of x, which can also be a QuantileSketch or a list of them
+    """
     if nbins is None:
         nbins = len(get_xaxis())-1
-    bins = np.percentile(x, np.linspace(0, 100, nbins+1))
-    np.append(bins, x.max())
+    bins = percentile_edges(x, nbins+1)
     if set:
         ax = plt.gca()
         x_ = np.linspace(0, 110, len(bins)+1)
@@ -478,13 +693,13 @@ def flat_bins(x, set=False, nbins=None,  fontsize=None, rotation=-90):
         return bins, np.linspace(0, 100, len(bins)+1)
 
 
-def purity_flatness_proba(x, mask, nbins=10, do_plot=False):
+def purity_flatness_proba(x, mask=None, nbins=10, do_plot=False):
     """ Returns the probability that the purity of x[mask] and x[~mask] is flat.
 
     This can be used as a measure of the information content in this observable regarding the mask.
 
     Args:
-        x: Observable or signal distribution
+        x: Observable or signal distribution, or PurityCounts
         mask: Boolean mask, like 'is signal', 'is background' or background distribution
         nbins: Number of bins to calculate the purity
         do_plot (bool): plot the purity distribution
@@ -495,14 +710,16 @@ def purity_flatness_proba(x, mask, nbins=10, do_plot=False):
 
     """
 
-    if len(pd.unique(mask)) > 2:
-        # if signal and background distribution are given as x and mask
-        x, mask = mask_append(x, mask)
-    
-    if np.std(x)==0:
-        return 1
+    if not isinstance(x, PurityCounts):
+        if len(pd.unique(mask)) > 2:
+            # if signal and background distribution are given as x and mask
+            x, mask = mask_append(x, mask)
+
+        if np.std(x)==0:
+            return 1
+        x = PurityCounts(x, mask, nbins)
 
-    pur, pure, b = purity_hist(x, mask, nbins=nbins, do_plot=do_plot)
+    pur, pure, b = purity_hist(x, nbins=nbins, do_plot=do_plot)
 
     mask = (np.isfinite(pur)) & (pur != 0)
     p = pur[mask]
@@ -527,7 +744,7 @@ def sig_bkg_plot(df, col, by=None, ax=None, bins=None, range=None, labels=None,
     """
 
     Args:
-        df:
+        df: DataFrame, Parquet file (read one row group at a time) or array
         col:
         by:
         ax:
@@ -540,8 +757,19 @@ def sig_bkg_plot(df, col, by=None, ax=None, bins=None, range=None, labels=None,
 
     """
 
+    # Parquet file, the two categories are filled chunk by chunk
+    if is_parquet_path(df):
+        assert isinstance(by, str), "Please provide by as column name"
+        x, cats = _stack_source(df, col, by, bins=bins, range=range, ax=ax)
+        assert len(x) > 1, "Did not found any categories in %s!" % by
+        if len(x) > 2:
+            warnings.warn("Warning, more than two categories in %s!" % by)
+        x_sig, x_bkg = x[0], x[1]
+        if len(cats) == 2 and labels is None:
+            labels = [by+f' == {cats[1]}', by+f' == {cats[0]}']
+
     # foreseen usage
-    if isinstance(df, pd.DataFrame):
+    elif isinstance(df, pd.DataFrame):
         # by is not a boolean index
         if isinstance(by, str):
             # won't work with weights at the moment
@@ -571,7 +799,10 @@ def sig_bkg_plot(df, col, by=None, ax=None, bins=None, range=None, labels=None,
             x_sig = df
             x_bkg = col
 
-    xaxis = _hist_init(np.append(x_sig, x_bkg), bins, xrange=range)
+    if isinstance(x_sig, HistAccumulator):
+        xaxis = x_sig.edges
+    else:
+        xaxis = _hist_init(np.append(x_sig, x_bkg), bins, xrange=range, ax=ax)
 
     if labels is None:
         labels = ["Background", "Signal"]
@@ -584,53 +815,153 @@ def sig_bkg_plot(df, col, by=None, ax=None, bins=None, range=None, labels=None,
 
 
 def get_upper_lim(x, perc=0.1, width=1, maxtries=100):
-    xmax = np.max(x)
-    xstd = width*np.std(x)
-    if xstd == 0:
-        return xmax
-    lx = len(x)
-    cut = xmax
-    i = 0
-    while i<maxtries:
-        cut -= xstd
-        px = 100*len(x[x>cut])/lx
-        if px>=perc:
-            cut+=xstd
-            break
-        i+=1
-    return cut
+    """ Upper edge of the range of x, which cuts away long tails
+
+    Starting from the maximum, the cut is lowered in steps of width standard deviations until at least perc percent of
+    x are above it, the cut one step before is returned. The steps are not tried one by one: the value with perc
+    percent of x above it is found with a single partition of x, which gives the number of steps directly.
+
+    Args:
+        x: array of values
+        perc: percentage of x which has to be above the next step
+        width: step size in standard deviations
+        maxtries: largest number of steps
+
+    Returns:
+        upper edge
+    """
+    return _tail_cut(np.asarray(x), perc, width, maxtries, upper=True)
 
 
 def get_lower_lim(x, perc=0.1, width=1, maxtries=100):
-    xmin = np.min(x)
-    xstd = width*np.std(x)
-    if xstd == 0:
-        return xmin
-    lx = len(x)
-    cut = xmin
-    i = 0
-    while i<maxtries:
-        cut += xstd
-        px = 100*len(x[x<cut])/lx
-        if px>=perc:
-            cut-=xstd
-            break
-        
-    return cut
+    """ Lower edge of the range of x, as get_upper_lim starting from the minimum
+    """
+    return _tail_cut(np.asarray(x), perc, width, maxtries, upper=False)
+
+
+def _tail_cut(x, perc, width, maxtries, upper):
+    start = np.max(x) if upper else np.min(x)
+    step = width*np.std(x)
+    if step == 0:
+        return start
+    sign = -1 if upper else 1
+
+    # the tail beyond the cut holds at least perc percent once the cut passes the n_tail-th value from the end
+    n_tail = max(int(np.ceil(perc / 100. * len(x))), 1)
+    # the percentage is compared as 100*count/len(x), which may round differently
+    if n_tail > 1 and 100*(n_tail - 1)/len(x) >= perc:
+        n_tail -= 1
+    elif 100*n_tail/len(x) < perc:
+        n_tail += 1
+    if n_tail > len(x):
+        value = -np.inf if upper else np.inf
+    else:
+        value = np.partition(x, len(x) - n_tail)[len(x) - n_tail] if upper else np.partition(x, n_tail - 1)[n_tail - 1]
+
+    # the cuts are accumulated step by step as in a loop, so that cuts on a value of x round the same way
+    cuts = np.cumsum(np.append(start, np.full(maxtries, sign*step)))[1:]
+    passed = np.flatnonzero(cuts < value if upper else cuts > value)
+    if not len(passed):
+        return cuts[-1] if maxtries else start
+    return cuts[passed[0]] - sign*step
 
 
 def minmax(x,perc=0.1, width=1, maxtries=100):
     return (get_lower_lim(x, perc, width, maxtries), get_upper_lim(x, perc, width, maxtries))
 
 
-def plot_feature_importance(fi, cols, figsize=None, palette='Blues_d',ax=None, *args, **kwargs):
+def rank_features(df, mask, columns=None, nbins=10, n_threads=None):
+    """ Separation of signal and background in each column of a DataFrame, e.g. to rank MVA inputs
+
+    The columns are converted to one 2D array, which is split into signal and background once. Each column is then
+    sorted per class, which gives the exact roc_auc by binary search and the counts of purity_flatness_proba in the
+    equal-frequency binning without binning the entries. The columns are processed by a pool of threads.
+
+    Args:
+        df: DataFrame
+        mask: Boolean mask or name of the column which is true for signal
+        columns: (optional) columns to rank, by default all numeric columns except the mask
+        nbins: Number of equal-frequency bin edges of purity_flatness_proba
+        n_threads: (optional) number of threads, None for all cores
+
+    Returns:
+        DataFrame indexed by column, sorted by separation, with the columns
+            auc: roc_auc of the column
+            separation: abs(2 * auc - 1), 0 for no separation and 1 for full separation in either direction
+            flatness_proba: purity_flatness_proba of the column
+
+    Examples:
+        >>> ranking = b2plot.analysis.rank_features(df, 'isSignal', variables)
+        >>> b2plot.analysis.plot_feature_importance(ranking.separation)
+
+    """
+    if isinstance(mask, str):
+        if columns is None:
+            columns = [c for c in df.select_dtypes('number').columns if c != mask]
+        mask = df[mask].values
+    elif columns is None:
+        columns = list(df.select_dtypes('number').columns)
+    mask = np.asarray(mask, dtype=bool)
+    assert len(mask) == len(df), "Mask and data length does not match"
+
+    # one row per column, split into signal and background once
+    values = np.ascontiguousarray(df[columns].to_numpy(dtype=float).T)
+    signal, background = values[:, mask], values[:, ~mask]
+    del values
+
+    def rank(i):
+        return _separation(_sorted_finite(signal[i]), _sorted_finite(background[i]), nbins)
+
+    n_threads = os.cpu_count() if n_threads is None else n_threads
+    with ThreadPoolExecutor(max(min(n_threads, len(columns)), 1)) as pool:
+        result = list(pool.map(rank, range(len(columns))))
+
+    ranking = pd.DataFrame(result, index=pd.Index(columns, name='feature'), columns=['auc', 'flatness_proba'])
+    ranking.insert(1, 'separation', np.abs(2 * ranking.auc - 1))
+    return ranking.sort_values('separation', ascending=False)
+
+
+def _sorted_finite(x):
+    """ Sort x in place and return the view of its finite values
+    """
+    x.sort()
+    return x[np.searchsorted(x, -np.inf, side='right'):np.searchsorted(x, np.inf, side='left')]
+
+
+def _separation(signal, background, nbins):
+    """ roc_auc and purity_flatness_proba from the sorted finite signal and background values of one column
+    """
+    if not len(signal) or not len(background):
+        return np.nan, np.nan
+
+    auc = _sorted_auc(signal, background)
+
+    # counts per bin from the positions of the edges, as bin_index the last bin includes its upper edge
+    edges = percentile_edges(np.concatenate((signal, background)), nbins)
+    counts = [np.diff(np.append(np.searchsorted(x, edges[:-1], side='left'), np.searchsorted(x, edges[-1], 'right')))
+              for x in (signal, background)]
+    counts = PurityCounts.from_counts(counts[0], counts[1], edges)
+    if not counts.informative:
+        return auc, 1
+    return auc, purity_flatness_proba(counts, nbins=nbins)
+
+
+def plot_feature_importance(fi, cols=None, figsize=None, palette='Blues_d',ax=None, *args, **kwargs):
+    """ Bar chart of the feature importance fi, which can also be a Series indexed by feature (e.g. a column of
+    rank_features)
+    """
+    if cols is None:
+        cols, fi = fi.index, fi.values
     if ax is None:
         plt.figure(figsize=figsize)
         ax = plt.gca()
     import seaborn as sns
     imp = np.argsort(fi)[::-1]
     dfplot= pd.DataFrame({'col':np.array(cols)[imp], 'imp':fi[imp]})
-    sns.barplot('imp', 'col', data=dfplot, hue_order=fi[imp][::-1], palette=palette, ax=ax, *args, **kwargs )
+    sns.barplot(x='imp', y='col', data=dfplot, ax=ax, *args, **kwargs)
+    # the palette is applied to the bars, seaborn only accepts it together with hue
+    for patch, color in zip(ax.patches, sns.color_palette(palette, len(dfplot))):
+        patch.set_facecolor(color)
     ax.set_xlabel("Importance",)
     ax.set_ylabel("Feature",)
     return np.array(cols)[imp]
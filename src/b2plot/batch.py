@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Render many plots of one DataFrame in a pool of processes.
+
+Each worker process uses the Agg backend and has its own manager, so the plots do not share any pyplot or binning
+state.
+
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+import matplotlib.pyplot as plt
+
+from .helpers import figure
+from .decorations import decorate
+from .functions import xlim
+from .histogram import hist, errorhist, stacked
+
+# DataFrame of the worker process, set once by _init_worker
+_df = None
+
+
+def render_batch(df, jobs, n_workers=None):
+    """ Render a list of plot jobs and save each to its own file
+
+    A job is a dict with the keys
+        column: column to plot
+        path: output file
+        kind: (optional) 'hist' (default), 'errorhist' or 'stacked'
+        bins, range, by, weights: (optional) passed on to the plot function
+        style: (optional) dict with further arguments of the plot function, e.g. color or lw
+        decorate: (optional) dict with arguments of decorate, by default the column is the x label
+
+    Args:
+        df: DataFrame with all columns used by the jobs
+        jobs: list of job dicts
+        n_workers: number of processes, None for all cores. With 1 the jobs are rendered in this process.
+
+    Returns:
+        list with one dict per job: path, the time spent on plotting, decorating and saving and the total time in
+        seconds, and the error message if the job failed
+
+    Examples:
+        >>> jobs = [{'column': v, 'bins': 50, 'path': 'plots/%s.pdf' % v} for v in variables]
+        >>> timing = b2plot.render_batch(df, jobs)
+
+    """
+    columns = []
+    for job in jobs:
+        assert 'column' in job and 'path' in job, "Please provide column and path for each job"
+        for key in ('column', 'by', 'weights'):
+            if isinstance(job.get(key), str) and job[key] not in columns:
+                columns.append(job[key])
+    df = df[columns]
+
+    n_workers = os.cpu_count() if n_workers is None else n_workers
+    n_workers = max(min(n_workers, len(jobs)), 1)
+
+    if n_workers == 1:
+        _init_worker(df, backend=None)
+        try:
+            return [_run_job(job) for job in jobs]
+        finally:
+            _init_worker(None, backend=None)
+
+    # the DataFrame goes to each worker once, the jobs are sent in chunks
+    chunksize = max(len(jobs) // (4 * n_workers), 1)
+    with ProcessPoolExecutor(n_workers, initializer=_init_worker, initargs=(df,)) as pool:
+        return list(pool.map(_run_job, jobs, chunksize=chunksize))
+
+
+def _init_worker(df, backend='Agg'):
+    global _df
+    _df = df
+    if backend is not None:
+        matplotlib.use(backend, force=True)
+
+
+def _run_job(job):
+    timing = {'path': job['path'], 'plot': 0., 'decorate': 0., 'save': 0., 'total': 0., 'error': None}
+    start = time.perf_counter()
+    f = figure()
+    try:
+        kind = job.get('kind', 'hist')
+        kwargs = dict(job.get('style', {}))
+        for key in ('bins', 'range'):
+            if key in job:
+                kwargs[key] = job[key]
+
+        if kind == 'stacked':
+            stacked(_df, job['column'], job['by'], weights=job.get('weights'), **kwargs)
+        else:
+            assert kind in ('hist', 'errorhist'), "Please use kind 'hist', 'errorhist' or 'stacked'"
+            plot = hist if kind == 'hist' else errorhist
+            weights = None if job.get('weights') is None else _df[job['weights']].values
+            plot(_df[job['column']].values, weights=weights, **kwargs)
+        timing['plot'] = time.perf_counter() - start
+
+        decorate(**job.get('decorate', {'xlabel': job['column']}))
+        xlim()
+        timing['decorate'] = time.perf_counter() - start - timing['plot']
+
+        f.savefig(job['path'], bbox_inches='tight')
+        timing['save'] = time.perf_counter() - start - timing['plot'] - timing['decorate']
+    except Exception as e:
+        timing['error'] = repr(e)
+    finally:
+        plt.close(f)
+
+    timing['total'] = time.perf_counter() - start
+    return timing
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+Binning kernels used by the histogram functions.
+
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Number of entries binned at once, the temporary arrays of one block stay in the cache
+BLOCK_SIZE = 65536
+# Largest lookup grid used for variable bin edges
+MAX_LOOKUP_CELLS = 2**16
+# Parallel filling is opt-in, see set_threads
+THREADS = 1
+MIN_PARALLEL_ENTRIES = 2**22
+
+
+def is_uniform(edges, rtol=1e-6):
+    """ Check if the bin edges are equidistant, as the ones from np.histogram or np.linspace
+
+    Args:
+        edges: bin edges
+        rtol: tolerated deviation from equidistant edges, relative to the bin width
+
+    Returns:
+        bool
+
+    """
+    edges = np.asarray(edges, dtype=float)
+    if len(edges) < 2 or not edges[-1] > edges[0]:
+        return False
+    width = (edges[-1] - edges[0]) / (len(edges) - 1)
+    return bool(np.max(np.abs(edges - np.linspace(edges[0], edges[-1], len(edges)))) <= rtol * width)
+
+
+def bin_index(data, edges, uniform=None):
+    """ Bin number of each entry for the given bin edges
+
+    Follows the np.histogram convention: all bins are half open [low, high), except for the last one which also
+    includes its upper edge. Equidistant edges are binned by index arithmetic, other edges with a binary search.
+
+    Args:
+        data: array of values
+        edges: monotonically increasing bin edges
+        uniform: (optional) skip the check for equidistant edges, if already known
+
+    Returns:
+        array of bin indices, entries outside of the edges (and NaN) get the index len(edges) - 1, i.e. one past
+        the last bin
+
+    """
+    data = np.asarray(data)
+    edges = np.asarray(edges, dtype=float)
+    nbins = len(edges) - 1
+
+    idx = _indexer(edges, uniform)(data)
+    idx -= 1
+    idx[idx < 0] = nbins
+    return np.minimum(idx, nbins, out=idx)
+
+
+def _indexer(edges, uniform=None):
+    """ Function returning the bin index of a block of data in the padded binning of _padded_edges
+
+    Equidistant edges use index arithmetic. Variable edges use the same arithmetic on a fine equidistant grid with at
+    most one edge per cell, followed by a lookup table, or a binary search if such a grid would be too large.
+    """
+    if uniform is None:
+        uniform = is_uniform(edges)
+    if uniform:
+        lower, upper = _padded_edges(edges)
+        tolerance = _rounding_tolerance(edges)
+        return lambda block: _uniform_bin_index(block, edges, lower, upper, tolerance)
+
+    widths = np.diff(edges)
+    n_cells = int(np.ceil((edges[-1] - edges[0]) / np.min(widths))) + 1 if np.min(widths) > 0 else np.inf
+    if n_cells > MAX_LOOKUP_CELLS:
+        return lambda block: _searchsorted_bin_index(block, edges)
+
+    grid = np.linspace(edges[0], edges[-1], n_cells + 1)
+    grid_lower, grid_upper = _padded_edges(grid)
+    grid_tolerance = _rounding_tolerance(grid)
+    lookup = np.concatenate(([0], np.searchsorted(edges, grid[:-1], side='right'), [len(edges)]))
+    lower, upper = _padded_edges(edges)
+
+    def index(block):
+        idx = lookup.take(_uniform_bin_index(block, grid, grid_lower, grid_upper, grid_tolerance))
+        idx -= block < lower.take(idx)
+        idx += block >= upper.take(idx)
+        return idx
+
+    return index
+
+
+def _padded_edges(edges):
+    """ Lower and upper edge of each bin, with an underflow bin in front and an overflow bin at the end
+
+    The upper edge of the last bin is moved up by one ulp, so that all bins can be treated as [low, high). The
+    overflow has no upper edge (NaN never compares true), so nothing is moved beyond it.
+    """
+    last = np.nextafter(edges[-1], np.inf)
+    lower = np.concatenate(([-np.inf], edges[:-1], [last]))
+    upper = np.concatenate(([edges[0]], edges[1:-1], [last, np.nan]))
+    return lower, upper
+
+
+def _rounding_tolerance(edges):
+    """ Distance from an edge, in bin widths, within which the index arithmetic can put an entry into the wrong bin
+
+    This is the largest deviation of the edges from equidistant ones plus a bound on the rounding error.
+    """
+    nbins = len(edges) - 1
+    width = (edges[-1] - edges[0]) / nbins
+    deviation = np.max(np.abs(edges - np.linspace(edges[0], edges[-1], len(edges)))) / width
+    return deviation + 16 * np.finfo(float).eps * (np.max(np.abs(edges[[0, -1]])) / width + nbins + 2)
+
+
+def _uniform_bin_index(data, edges, lower, upper, tolerance):
+    """ Bin index by direct arithmetic, corrected by one bin where rounding puts an entry on the wrong side of an edge
+
+    Only the entries closer to an edge than tolerance (in bin widths, see _rounding_tolerance) are compared with the
+    edges, which are very few.
+
+    Returns indices in the padded binning of _padded_edges: 0 is the underflow (and NaN), len(edges) the overflow.
+    """
+    nbins = len(edges) - 1
+    scale = nbins / (edges[-1] - edges[0])
+
+    shifted = data * scale
+    shifted -= edges[0] * scale - 1
+    distance = np.rint(shifted)
+    # infinite entries give NaN, they are not near an edge
+    with np.errstate(invalid="ignore"):
+        distance -= shifted
+    near = np.flatnonzero(np.abs(distance, out=distance) < tolerance)
+    # fmax/fmin also send NaN to the underflow
+    np.fmax(shifted, 0, out=shifted)
+    np.fmin(shifted, nbins + 1, out=shifted)
+    idx = shifted.astype(np.intp)
+
+    if len(near):
+        near_data, near_idx = data[near], idx[near]
+        near_idx -= near_data < lower.take(near_idx)
+        near_idx += near_data >= upper.take(near_idx)
+        idx[near] = near_idx
+    return idx
+
+
+def _searchsorted_bin_index(data, edges):
+    """ Bin index by binary search, in the padded binning of _padded_edges (NaN goes to the overflow)
+    """
+    idx = np.searchsorted(edges, data, side='right')
+    idx[data == edges[-1]] = len(edges) - 1
+    return idx
+
+
+def _sorted_counts(data, edges):
+    """ Unweighted counts in the padded binning of _padded_edges, by sorting the data instead of searching each entry
+    """
+    data = np.sort(data)
+    positions = np.concatenate(([0], np.searchsorted(data, edges[:-1], side='left'),
+                                np.searchsorted(data, edges[-1:], side='right'), [len(data)]))
+    return np.diff(positions)
+
+
+def set_threads(n_threads=None, min_entries=None):
+    """ Opt in to filling large histograms with several threads
+
+    The data are split into one slice per thread, each slice is filled into its own partial histogram and the partial
+    histograms are added up. The heavy lifting is done by NumPy operations which release the GIL.
+
+    Args:
+        n_threads: number of threads, None for all cores, 1 switches back to serial filling
+        min_entries: (optional) fills with fewer entries than this always run serially
+
+    """
+    global THREADS, MIN_PARALLEL_ENTRIES
+    THREADS = os.cpu_count() if n_threads is None else max(int(n_threads), 1)
+    if min_entries is not None:
+        MIN_PARALLEL_ENTRIES = int(min_entries)
+
+
+def fill(data, edges, weights=None, n_threads=None):
+    """ Fill a histogram in a single pass over the data
+
+    The data are processed in blocks of BLOCK_SIZE entries. For equidistant edges the bin index is computed by
+    direct arithmetic, for variable edges through a lookup grid or a binary search. Unweighted data with variable
+    edges are counted by sorting each block.
+
+    Args:
+        data: array of values
+        edges: bin edges
+        weights: (optional) weight for each entry
+        n_threads: (optional) number of threads, by default the setting of set_threads is used
+
+    Returns:
+        sumw, sumw2, counts: sum of weights, sum of squared weights and number of entries per bin
+
+    """
+    sumw, sumw2, counts = _fill(data, edges, weights, n_threads)
+    return sumw[0], sumw2[0], counts[0]
+
+
+def fill_grouped(data, codes, n_groups, edges, weights=None, n_threads=None):
+    """ Fill one histogram per group in a single pass over the data
+
+    The bin index and the group code of each entry are combined into one index, so a single bincount produces the
+    histograms of all groups, e.g. all components of a stacked histogram.
+
+    Args:
+        data: array of values
+        codes: integer group code of each entry, from 0 to n_groups - 1
+        n_groups: number of groups
+        edges: bin edges
+        weights: (optional) weight for each entry
+        n_threads: (optional) number of threads, by default the setting of set_threads is used
+
+    Returns:
+        sumw, sumw2, counts: arrays of shape (n_groups, number of bins)
+
+    """
+    return _fill(data, edges, weights, n_threads, np.asarray(codes, dtype=np.intp), n_groups)
+
+
+def _fill(data, edges, weights=None, n_threads=None, codes=None, n_groups=1):
+    data = np.asarray(data)
+    edges = np.asarray(edges, dtype=float)
+    nbins = len(edges) - 1
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float)
+
+    uniform = is_uniform(edges)
+    index = _indexer(edges, uniform)
+
+    def fill_slice(first, last):
+        return _fill_padded(data[first:last], edges, nbins, uniform, index,
+                            None if weights is None else weights[first:last],
+                            None if codes is None else codes[first:last], n_groups)
+
+    n_threads = THREADS if n_threads is None else n_threads
+    n_blocks = -(-len(data) // BLOCK_SIZE)
+    n_threads = min(n_threads, n_blocks)
+    if n_threads > 1 and len(data) >= MIN_PARALLEL_ENTRIES:
+        # slice boundaries on multiples of BLOCK_SIZE
+        bounds = [BLOCK_SIZE * (n_blocks * i // n_threads) for i in range(n_threads)] + [len(data)]
+        with ThreadPoolExecutor(n_threads) as pool:
+            partials = list(pool.map(lambda i: fill_slice(bounds[i], bounds[i + 1]), range(n_threads)))
+        counts, sumw, sumw2 = [None if partials[0][i] is None else sum(p[i] for p in partials) for i in range(3)]
+    else:
+        counts, sumw, sumw2 = fill_slice(0, len(data))
+
+    counts = counts.reshape(n_groups, nbins + 2)[:, 1:-1]
+    if weights is None:
+        sumw = counts.astype(float)
+        return sumw, sumw.copy(), counts
+    return sumw.reshape(n_groups, nbins + 2)[:, 1:-1], sumw2.reshape(n_groups, nbins + 2)[:, 1:-1], counts
+
+
+def _fill_padded(data, edges, nbins, uniform, index, weights=None, codes=None, n_groups=1):
+    """ Serial block-wise filling into the padded binning, groups are stored one after the other
+
+    sumw and sumw2 are None without weights.
+    """
+    size = n_groups * (nbins + 2)
+    counts = np.zeros(size, dtype=np.intp)
+    sumw = sumw2 = None
+    if weights is not None:
+        sumw = np.zeros(size)
+        sumw2 = np.zeros(size)
+
+    for start in range(0, len(data), BLOCK_SIZE):
+        block = data[start:start + BLOCK_SIZE]
+        if weights is None and codes is None and not uniform:
+            counts += _sorted_counts(block, edges)
+            continue
+
+        idx = index(block)
+        if codes is not None:
+            idx += codes[start:start + BLOCK_SIZE] * (nbins + 2)
+        counts += np.bincount(idx, minlength=size)
+        if weights is not None:
+            block_weights = weights[start:start + BLOCK_SIZE]
+            sumw += np.bincount(idx, weights=block_weights, minlength=size)
+            sumw2 += np.bincount(idx, weights=block_weights * block_weights, minlength=size)
+
+    return counts, sumw, sumw2
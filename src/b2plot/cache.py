@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in on-disk cache for histogram contents.
+
+When enabled, hist, errorhist and stacked look up the bin contents of their input before binning it. The contents
+are stored as small .npz files, keyed by a fingerprint of the data, the weights and the bin edges. Scale factors are
+applied to the bin contents afterwards, so a scaled histogram reuses the cached contents.
+
+Examples:
+    >>> b2plot.enable_cache()
+    >>> b2plot.hist(df.x)  # binned and stored
+    >>> b2plot.hist(df.x, color='red')  # read from the cache
+    >>> b2plot.cache_info()
+    {'hits': 1, 'misses': 1, 'entries': 1, 'size': 1570}
+
+"""
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from .binning import fill, fill_grouped
+
+# None means the cache is disabled
+CACHE_DIR = None
+MAX_SIZE = 2**28
+# Hash all bytes of the input instead of a sample, see fingerprint
+EXACT = False
+# Number of entries of each array which go into the fast fingerprint
+SAMPLE_SIZE = 4096
+
+_stats = {'hits': 0, 'misses': 0}
+
+
+def enable_cache(path=None, max_size=None, exact=False):
+    """ Cache bin contents on disk
+
+    Args:
+        path: cache directory, by default ~/.cache/b2plot
+        max_size: (optional) size of the cache in bytes, the least recently used entries are removed above it
+        exact: hash the full input instead of the fast fingerprint
+
+    """
+    global CACHE_DIR, MAX_SIZE, EXACT
+    CACHE_DIR = os.path.expanduser(os.path.join("~", ".cache", "b2plot") if path is None else path)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    if max_size is not None:
+        MAX_SIZE = int(max_size)
+    EXACT = exact
+
+
+def disable_cache():
+    global CACHE_DIR
+    CACHE_DIR = None
+
+
+def clear_cache():
+    """ Remove all cached histograms and reset the counters
+    """
+    for entry in _entries():
+        os.remove(entry.path)
+    _stats['hits'] = _stats['misses'] = 0
+
+
+def cache_info():
+    """ Hits and misses since the cache was enabled or cleared, number of entries and size in bytes
+
+    Returns:
+        dict
+
+    """
+    entries = _entries()
+    return dict(_stats, entries=len(entries), size=sum(entry.stat().st_size for entry in entries))
+
+
+def fingerprint(data, edges, weights=None, codes=None, exact=False):
+    """ Key for the histogram of data with the given binning
+
+    The fast fingerprint hashes the shape and dtype, a strided sample and the sum of each array, and the sum of the
+    weights times the data (or of the data per group), which are much cheaper than binning. Inputs which differ only
+    in entries outside of the sample and with identical sums get the same key, use exact=True to exclude this.
+
+    Args:
+        data: array of values
+        edges: bin edges
+        weights: (optional) weight for each entry
+        codes: (optional) group code for each entry, see binning.fill_grouped
+        exact: hash all bytes of the arrays
+
+    Returns:
+        hex digest
+
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(np.asarray(edges, dtype=float).tobytes())
+    for array in (data, weights, codes):
+        if array is None:
+            h.update(b'none')
+            continue
+        h.update(str((array.dtype.str, array.shape)).encode())
+        if exact:
+            h.update(np.ascontiguousarray(array).view(np.uint8))
+        else:
+            h.update(np.ascontiguousarray(array[::max(len(array) // SAMPLE_SIZE, 1)]).view(np.uint8))
+            h.update(_finite_guard(np.add.reduce, array))
+
+    if not exact and len(data):
+        if weights is not None:
+            h.update(_finite_guard(np.dot, data, weights))
+        if codes is not None:
+            h.update(_finite_guard(lambda d, c: np.bincount(c, weights=d, minlength=codes.max() + 1), data, codes))
+    return h.hexdigest()
+
+
+def _finite_guard(func, *arrays):
+    """ Bytes of func(*arrays), a sum over all entries
+
+    A single NaN turns the sum into NaN, which would hide any other difference. In that case the sum is taken over
+    the entries where all arrays are finite and the number of the other entries is added.
+    """
+    result = np.asarray(func(*arrays))
+    if np.isfinite(result).all():
+        return result.tobytes()
+    finite = np.logical_and.reduce([np.isfinite(a) for a in arrays])
+    result = np.asarray(func(*[a[finite] for a in arrays]))
+    return result.tobytes() + np.asarray(len(finite) - np.count_nonzero(finite)).tobytes()
+
+
+def cached_fill(data, edges, weights=None, n_threads=None):
+    """ binning.fill, looked up in the cache if it is enabled
+    """
+    if CACHE_DIR is None:
+        return fill(data, edges, weights, n_threads)
+    data, weights = np.asarray(data), None if weights is None else np.asarray(weights, dtype=float)
+    if data.dtype == object:
+        return fill(data, edges, weights, n_threads)
+
+    key = fingerprint(data, edges, weights, exact=EXACT)
+    return _lookup(key, lambda: fill(data, edges, weights, n_threads))
+
+
+def cached_fill_grouped(data, codes, n_groups, edges, weights=None, n_threads=None):
+    """ binning.fill_grouped, looked up in the cache if it is enabled
+    """
+    if CACHE_DIR is None:
+        return fill_grouped(data, codes, n_groups, edges, weights, n_threads)
+    data, codes = np.asarray(data), np.asarray(codes, dtype=np.intp)
+    weights = None if weights is None else np.asarray(weights, dtype=float)
+    if data.dtype == object:
+        return fill_grouped(data, codes, n_groups, edges, weights, n_threads)
+
+    key = fingerprint(data, edges, weights, codes, exact=EXACT) + '-%d' % n_groups
+    return _lookup(key, lambda: fill_grouped(data, codes, n_groups, edges, weights, n_threads))
+
+
+def _lookup(key, compute):
+    path = os.path.join(CACHE_DIR, key + '.npz')
+    try:
+        with np.load(path) as stored:
+            result = stored['sumw'], stored['sumw2'], stored['counts']
+        # the modification time orders the entries for the eviction
+        os.utime(path)
+        _stats['hits'] += 1
+        return result
+    except (OSError, KeyError, ValueError):
+        pass
+
+    _stats['misses'] += 1
+    result = compute()
+    _store(path, result)
+    return result
+
+
+def _store(path, result):
+    sumw, sumw2, counts = result
+    fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, sumw=sumw, sumw2=sumw2, counts=counts)
+        os.replace(tmp, path)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return
+    _evict()
+
+
+def _entries():
+    if CACHE_DIR is None or not os.path.isdir(CACHE_DIR):
+        return []
+    return [entry for entry in os.scandir(CACHE_DIR) if entry.name.endswith('.npz')]
+
+
+def _evict():
+    """ Remove the least recently used entries until the cache fits into MAX_SIZE
+    """
+    entries = [(entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in _entries()]
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= MAX_SIZE:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
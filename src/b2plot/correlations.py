@@ -6,13 +6,20 @@ Author:
 
 """
 
+import os
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
-from scipy.stats import binned_statistic_2d
 from scipy import stats
 import matplotlib.pylab as plt
+import matplotlib.colors as mcolors
 import pandas as pd
 import seaborn as sns
 
+from .binning import bin_index, BLOCK_SIZE
+from .sources import is_parquet_path, read_parquet
+
 
 def corrmatrix(corr, separate_first=0, x_label_rot=45, invert_y=True, label_font_size=None, ax=None, *args, **kwargs):
     """
@@ -37,6 +44,80 @@ def corrmatrix(corr, separate_first=0, x_label_rot=45, invert_y=True, label_font
         plt.axvline(separate_first, color='gray',lw=1)
 
 
+def flat_nbins(n):
+    """ Number of equal-frequency bin edges used for n entries with nbins='auto'
+    """
+    return int(2*(3*n**(1/3))**(1/2))
+
+
+def flat_digitize(x, nbins):
+    """ Equal-frequency bin index of each entry of x
+
+    Args:
+        x: array of values
+        nbins: number of percentiles used as bin edges, equal edges are merged
+
+    Returns:
+        codes, n: bin index of each entry and the number of bins, entries outside of the edges (NaN) get the index n
+    """
+    x = np.asarray(x)
+    edges = pd.unique(np.percentile(x, np.linspace(0, 100, nbins)))
+    # the smallest integer type, many columns of codes are kept in memory for the matrix
+    return bin_index(x, edges).astype(np.min_scalar_type(len(edges))), len(edges) - 1
+
+
+def flat_counts(x_codes, nx, y_codes, ny):
+    """ 2D histogram of two digitized columns with a single bincount, rows are the bins of y
+
+    Returns:
+        array of shape (ny, nx)
+    """
+    index = y_codes.astype(np.intp)
+    index *= nx + 1
+    index += x_codes
+    counts = np.bincount(index, minlength=(nx + 1) * (ny + 1))
+    return counts.reshape(ny + 1, nx + 1)[:ny, :nx].astype(float)
+
+
+def flat_significance(a0, n, nbins):
+    """ Significance of the deviation of each bin from the expectation for uncorrelated distributions
+
+    The expectation takes the marginal distributions into account, which are flat apart from ties. a0 can hold a
+    stack of histograms of the same shape, which are evaluated at once.
+
+    Args:
+        a0: counts of shape (..., ny, nx), see flat_counts
+        n: number of entries
+        nbins: number of percentiles used for the binning
+
+    Returns:
+        significance, flat_probability: significance of each bin (NaN for empty bins) and chi2 probability of the
+        significances for a flat distribution
+    """
+    nexp_total = n/((nbins-1)**2)
+
+    m1 = a0.sum(axis=-1, keepdims=True)/(a0.shape[-1])
+    m1 /= np.min(m1, axis=-2, keepdims=True)
+    m0 = a0.sum(axis=-2, keepdims=True)/(a0.shape[-2])
+    m0 /= np.min(m0, axis=-1, keepdims=True)
+
+    m_exp = nexp_total * m1 * m0
+    m_stat = m_exp**0.5
+
+    a = (a0-m_exp)/(np.sqrt(a0)+m_stat)
+    a[a0==0] = None
+
+    # Calculate chi2 probability
+    dim = (nbins)**2-(nbins-1)-(nbins-1)-1
+    flat_probability = stats.distributions.chi2.sf(np.nansum(a*a, axis=(-2, -1)), dim)
+    return a, flat_probability
+
+
+def _draw_flat(ax, a, cmap, zoom=1):
+    cmap=plt.get_cmap(cmap) if isinstance(cmap, str) else cmap
+    return ax.imshow(a, cmap=plt.get_cmap(cmap), interpolation='nearest', origin='lower',vmin=-5*zoom, vmax=5*zoom)
+
+
 def flat_correlation(x,y, nbins='auto', zoom=1, nlabels=5, ax=None, ax_fmt='%.2e', x_label_rot=45, invert_y=True, draw_labels=True, get_im=False, cmap='jet', ):
     """ Calculate and plot a 2D correlation in flat binning.
     This function calculates an equal frequency binning for x and y and fills a 2D histogram with this binning.
@@ -62,31 +143,14 @@ def flat_correlation(x,y, nbins='auto', zoom=1, nlabels=5, ax=None, ax_fmt='%.2e
     ax = plt.gca() if ax is None else ax
     
     # calculate equal fequrency binning
-    nbins = int(2*(3*len(x)**(1/3))**(1/2)) if nbins=='auto' else nbins
-    binsx = pd.unique(np.percentile(x, np.linspace(0,100, nbins)))
-    binsy = pd.unique(np.percentile(y, np.linspace(0,100, nbins)))
-    # Bin count
-    bs = binned_statistic_2d(x, y, values=x, statistic='count', bins=[binsx,binsy])
-    # Calculate actual count - expected significance
-    nexp_total = len(x)/((nbins-1)**2)
-
-    a0 = bs.statistic.T
-
-    m1 = a0.sum(axis=1)/(a0.shape[1])
-    m1 /= np.min(m1)
-    m0 = a0.sum(axis=0)/(a0.shape[0])
-    m0 /= np.min(m0)
-    
-    beta = np.full( a0.shape, nexp_total)
-    m_exp = (beta.T*(m1).astype(float)).T*(m0).astype(float)
-    m_stat = m_exp**0.5
-    
-    a = (a0-m_exp)/(np.sqrt(a0)+m_stat)
+    nbins = flat_nbins(len(x)) if nbins=='auto' else nbins
+    x_codes, nx = flat_digitize(x, nbins)
+    y_codes, ny = flat_digitize(y, nbins)
+    # Bin count and actual count - expected significance
+    a, flat_probability = flat_significance(flat_counts(x_codes, nx, y_codes, ny), len(x), nbins)
 
-    a[a0==0] = None
     # Plotting
-    cmap=plt.get_cmap(cmap) if isinstance(cmap, str) else cmap
-    im = ax.imshow(a, cmap=plt.get_cmap(cmap), interpolation='nearest', origin='lower',vmin=-5*zoom, vmax=5*zoom)
+    im = _draw_flat(ax, a, cmap, zoom)
     # set labels
     if draw_labels:
         cbar = plt.colorbar(im,fraction=0.046, pad=0.04, ax=ax)
@@ -102,10 +166,6 @@ def flat_correlation(x,y, nbins='auto', zoom=1, nlabels=5, ax=None, ax_fmt='%.2e
     else:
         ax.set_xticklabels([])
         ax.set_yticklabels([])
-    # Calculate chi2 probability
-    dim = (nbins)**2-(nbins-1)-(nbins-1)-1
-    flat_probability = stats.distributions.chi2.sf(np.nansum(a*a), dim)
-
     if invert_y:
         ax.invert_yaxis()
 
@@ -115,9 +175,13 @@ def flat_correlation(x,y, nbins='auto', zoom=1, nlabels=5, ax=None, ax_fmt='%.2e
 
 
 def flat_corr_matrix(df, pdf=None, tight=False, labels=None, label_size=None, size=12, n_labels=3, 
-                     fontsize='auto', draw_cbar=False,  tick_label_rotation=45, formatter='%.2e', label_rotation=45, cmap='PiYG'):
+                     fontsize='auto', draw_cbar=False,  tick_label_rotation=45, formatter='%.2e', label_rotation=45, cmap='PiYG',
+                     single_image=False, n_threads=None):
     """ Draws a flat correlation matrix of df
 
+    By default each pair of columns gets its own axes. With single_image all maps are tiled into one image on a single
+    axes (see flat_corr_image), which keeps the time and memory for drawing small also for many columns.
+
     Args:
         df:
         pdf:
@@ -131,6 +195,8 @@ def flat_corr_matrix(df, pdf=None, tight=False, labels=None, label_size=None, si
         draw_cbar:
         rotation:
         formatter:
+        single_image: draw all maps as one image
+        n_threads: (optional) number of threads used to compute the maps, None for all cores
 
     Returns:
 
@@ -147,36 +213,50 @@ def flat_corr_matrix(df, pdf=None, tight=False, labels=None, label_size=None, si
         labels = df.columns
     else:
         assert len(labels) == len(df.columns), "Numbers of labels not matching the numbers of coulums in the df"
+
+    # Each column is digitized once, each cell is a single bincount of two columns
+    nbins = flat_nbins(len(df))
+    n_threads = os.cpu_count() if n_threads is None else n_threads
+    codes = _flat_codes(df, nbins, n_threads)
+
     im = None
-    fig, axes = plt.subplots(nrows=n_vars, ncols=n_vars, figsize=(size, size))
-
-    # Plotting the matrix, iterate over the columns in 2D
-    for i, row in zip(range(n_vars), axes):
-        for j, ax in zip(range(n_vars), row):
-            if i is j - 1000:
-                plt.sca(ax)
-                ax.hist(df.iloc[:, i].values, label='data', color='gray')
+    if single_image:
+        fig, ax = plt.subplots(figsize=(size, size))
+        significance, _ = _flat_tensor(codes, len(df), nbins, n_threads)
+        im = flat_corr_image(significance, ax=ax, cmap=cmap)
+        _set_flat_image_labels(ax, df, [n for _, n in codes], labels, fontsize, label_rotation, label_size, n_labels,
+                               tick_label_rotation, formatter)
+        if tight:
+            plt.tight_layout()
+    else:
+        fig, axes = plt.subplots(nrows=n_vars, ncols=n_vars, figsize=(size, size))
+        significance, _ = flat_corr_significance(codes, len(df), nbins, n_threads)
+
+        # Plotting the matrix, iterate over the columns in 2D
+        for i, row in zip(range(n_vars), axes):
+            for j, ax in zip(range(n_vars), row):
+                im = _draw_flat(ax, significance[i][j], cmap)
+                ax.set_xticklabels([])
                 ax.set_yticklabels([])
-            else:
-                im = flat_correlation(df.iloc[:, j], df.iloc[:, i], ax=ax, draw_labels=False, get_im=True,cmap=cmap)
-            ax.xaxis.set_major_locator(plt.NullLocator())
-            ax.yaxis.set_major_locator(plt.NullLocator())
-
-    if tight:
-        plt.tight_layout()
-
-    # Common outer label
-    for i, row in zip(range(n_vars), axes):
-        for j, ax in zip(range(n_vars), row):
-            if i == n_vars - 1:
-                if label_size is not None:
-                    set_flat_labels(ax, df.iloc[:, j], axis=1, n_labels=n_labels, labelsize=label_size, rotation=90 if tick_label_rotation == 0 else tick_label_rotation, formatter=formatter)
+                ax.invert_yaxis()
+                ax.xaxis.set_major_locator(plt.NullLocator())
+                ax.yaxis.set_major_locator(plt.NullLocator())
+
+        if tight:
+            plt.tight_layout()
+
+        # Common outer label
+        for i, row in zip(range(n_vars), axes):
+            for j, ax in zip(range(n_vars), row):
+                if i == n_vars - 1:
+                    if label_size is not None:
+                        set_flat_labels(ax, df.iloc[:, j], axis=1, n_labels=n_labels, labelsize=label_size, rotation=90 if tick_label_rotation == 0 else tick_label_rotation, formatter=formatter)
                 
-                ax.set_xlabel(labels[j], fontsize=fontsize, rotation=label_rotation,  ha='right', va='top')
-            if j == 0:
-                if label_size is not None: 
-                    set_flat_labels(ax, df.iloc[:, i], axis=0, n_labels=n_labels, labelsize=label_size, rotation=tick_label_rotation, formatter=formatter)
-                ax.set_ylabel(labels[i], fontsize=fontsize, rotation=label_rotation, ha='right', va='bottom')
+                    ax.set_xlabel(labels[j], fontsize=fontsize, rotation=label_rotation,  ha='right', va='top')
+                if j == 0:
+                    if label_size is not None: 
+                        set_flat_labels(ax, df.iloc[:, i], axis=0, n_labels=n_labels, labelsize=label_size, rotation=tick_label_rotation, formatter=formatter)
+                    ax.set_ylabel(labels[i], fontsize=fontsize, rotation=label_rotation, ha='right', va='bottom')
 
     if pdf is None:
         # plt.show()
@@ -192,6 +272,189 @@ def flat_corr_matrix(df, pdf=None, tight=False, labels=None, label_size=None, si
         cbar.ax.tick_params(labelsize=fontsize)
         
 
+def flat_corr_significance(codes, n, nbins, n_threads=1):
+    """ Significance maps and flat probabilities of all pairs of digitized columns
+
+    Only the upper triangle is computed, the map of (j, i) is the transpose of the one of (i, j). The cells with the
+    same binning are stacked and evaluated by one call of flat_significance. The rows of the triangle are distributed
+    over a pool of threads.
+
+    Args:
+        codes: list of (codes, number of bins) of each column, see flat_digitize
+        n: number of entries
+        nbins: number of percentiles used for the binning
+        n_threads: number of threads
+
+    Returns:
+        significance, flat_probability: nested list, element [i][j] is the significance map with column j in x and
+        column i in y, and the array of the chi2 flat probabilities of shape (n_vars, n_vars)
+    """
+    n_vars = len(codes)
+
+    def row(i):
+        cells = {}
+        for j in range(i, n_vars):
+            cells.setdefault((codes[i][1], codes[j][1]), []).append(j)
+        result = {}
+        for columns in cells.values():
+            counts = np.array([flat_counts(codes[j][0], codes[j][1], codes[i][0], codes[i][1]) for j in columns])
+            maps, probabilities = flat_significance(counts, n, nbins)
+            result.update(zip(columns, zip(maps, probabilities)))
+        return result
+
+    # the rows get shorter, the pool hands them out one at a time
+    with ThreadPoolExecutor(max(min(n_threads, n_vars), 1)) as pool:
+        rows = list(pool.map(row, range(n_vars)))
+
+    significance = [[None] * n_vars for _ in range(n_vars)]
+    flat_probability = np.empty((n_vars, n_vars))
+    for i, result in enumerate(rows):
+        for j, (a, probability) in result.items():
+            significance[i][j], significance[j][i] = a, a.T
+            flat_probability[i, j] = flat_probability[j, i] = probability
+    return significance, flat_probability
+
+
+def flat_corr_tensor(df, nbins='auto', n_threads=None):
+    """ Flat correlations of all pairs of columns, without drawing
+
+    Each column is digitized into its equal-frequency bins once, each pair of columns is a single bincount. The work is
+    spread over a pool of threads.
+
+    Args:
+        df: DataFrame
+        nbins: int or 'auto', number of bins in x and y
+        n_threads: (optional) number of threads, None for all cores
+
+    Returns:
+        significance, flat_probability: array of shape (n_vars, n_vars, n, n), element [i, j] is the significance
+        map of flat_correlation(df.iloc[:, j], df.iloc[:, i]). n is the largest number of bins of any column after
+        equal percentiles are merged, at most nbins - 1, the maps of columns with fewer bins are padded with NaN. And
+        the array of the chi2 flat probabilities of shape (n_vars, n_vars)
+
+    Examples:
+        >>> significance, proba = b2plot.flat_corr_tensor(df[variables])
+        >>> b2plot.flat_corr_image(significance, labels=variables)
+
+    """
+    assert isinstance(df, pd.DataFrame), 'Argument of wrong type! Needs pd.DataFrame'
+    nbins = flat_nbins(len(df)) if nbins == 'auto' else nbins
+    n_threads = os.cpu_count() if n_threads is None else n_threads
+    return _flat_tensor(_flat_codes(df, nbins, n_threads), len(df), nbins, n_threads)
+
+
+def _flat_codes(df, nbins, n_threads):
+    """ flat_digitize of each column of df, the columns are distributed over a pool of threads
+    """
+    n_vars = np.shape(df)[1]
+    with ThreadPoolExecutor(max(min(n_threads, n_vars), 1)) as pool:
+        return list(pool.map(lambda i: flat_digitize(df.iloc[:, i].values, nbins), range(n_vars)))
+
+
+def _flat_tensor(codes, n, nbins, n_threads):
+    """ Significance maps of flat_corr_significance, padded with NaN to one array, see flat_corr_tensor
+    """
+    n_vars = len(codes)
+    maps, flat_probability = flat_corr_significance(codes, n, nbins, n_threads)
+
+    size = max([n for _, n in codes] + [0])
+    significance = np.full((n_vars, n_vars, size, size), np.nan)
+    for i in range(n_vars):
+        for j in range(n_vars):
+            significance[i, j, :maps[i][j].shape[0], :maps[i][j].shape[1]] = maps[i][j]
+    return significance, flat_probability
+
+
+def flat_corr_image(significance, labels=None, ax=None, zoom=1, cmap='PiYG', fontsize=None, label_rotation=45,
+                    draw_cbar=False, grid_color='gray'):
+    """ Draws the significance maps of flat_corr_tensor as one image
+
+    The maps are tiled into a single array, which is drawn with one imshow, separated by grid lines. The time and
+    memory needed do not grow with the number of axes, as there is only one.
+
+    Args:
+        significance: array of shape (n_vars, n_vars, n, n), see flat_corr_tensor
+        labels: (optional) names of the columns
+        ax: axes, if None, takes current
+        zoom: factor f of the significance [-f*5,f*5]
+        cmap: colormap
+        fontsize: (optional) size of the labels
+        label_rotation: rotation of the x labels
+        draw_cbar: draw a colorbar
+        grid_color: color of the lines between the maps, None for no lines
+
+    Returns:
+        image
+    """
+    ax = plt.gca() if ax is None else ax
+    n_vars, _, ny, nx = np.shape(significance)
+
+    # as in flat_corr_matrix, the first row of each map is at the top
+    tiled = np.asarray(significance).transpose(0, 2, 1, 3).reshape(n_vars * ny, n_vars * nx)
+    cmap = plt.get_cmap(cmap) if isinstance(cmap, str) else cmap
+    im = ax.imshow(tiled, cmap=cmap, interpolation='nearest', vmin=-5*zoom, vmax=5*zoom,
+                   extent=(0, n_vars, n_vars, 0), aspect='equal')
+
+    if grid_color is not None:
+        ax.vlines(np.arange(1, n_vars), 0, n_vars, color=grid_color, lw=0.5)
+        ax.hlines(np.arange(1, n_vars), 0, n_vars, color=grid_color, lw=0.5)
+
+    centers = np.arange(n_vars) + 0.5
+    ax.set_xticks(centers)
+    ax.set_yticks(centers)
+    if labels is None:
+        ax.set_xticklabels([])
+        ax.set_yticklabels([])
+    else:
+        assert len(labels) == n_vars, "Numbers of labels not matching the numbers of maps"
+        ax.set_xticklabels(labels, fontsize=fontsize, rotation=label_rotation, ha='right')
+        ax.set_yticklabels(labels, fontsize=fontsize)
+    ax.tick_params(length=0)
+
+    if draw_cbar:
+        cbar = plt.colorbar(im, fraction=0.046, pad=0.04, ax=ax)
+        cbar.set_label("$\\sigma$ ", rotation=0)
+    return im
+
+
+def _set_flat_image_labels(ax, df, filled, labels, fontsize, label_rotation, label_size, n_labels,
+                           tick_label_rotation, formatter):
+    """ Outer labels of flat_corr_image: the column names and, with label_size, the percentiles of each column
+
+    filled is the number of bins of each column, see flat_digitize.
+    """
+    n_vars = np.shape(df)[1]
+    centers = np.arange(n_vars) + 0.5
+    if label_size is None:
+        ax.set_xticklabels(labels, fontsize=fontsize, rotation=label_rotation, ha='right')
+        ax.set_yticklabels(labels, fontsize=fontsize)
+        return
+
+    # percentiles on the major ticks of each map, the names on minor ticks further out. The percentiles are taken at
+    # the centres of n_labels equal slices of each map, so that the labels of neighbouring maps do not touch.
+    # Maps with fewer bins (ties) only fill the corresponding part of their cell.
+    fractions = (np.arange(n_labels) + 0.5) / n_labels
+    filled = np.asarray(filled, dtype=float)
+    positions = (np.arange(n_vars)[:, None] + fractions * (filled / filled.max())[:, None]).ravel()
+    values = [formatter % v for i in range(n_vars) for v in np.percentile(df.iloc[:, i], 100 * fractions)]
+    pad = 0.7 * label_size * max(len(v) for v in values)
+    ax.set_xticks(positions)
+    ax.set_xticklabels(values, fontsize=label_size, rotation=90 if tick_label_rotation == 0 else tick_label_rotation,
+                       ha='right')
+    ax.set_yticks(positions)
+    ax.set_yticklabels(values, fontsize=label_size, rotation=tick_label_rotation, va='top')
+    ax.tick_params(length=2)
+
+    # the names are drawn also where a percentile tick sits at the centre
+    ax.xaxis.remove_overlapping_locs = False
+    ax.yaxis.remove_overlapping_locs = False
+    ax.set_xticks(centers, minor=True)
+    ax.set_xticklabels(labels, minor=True, fontsize=fontsize, rotation=label_rotation, ha='right')
+    ax.set_yticks(centers, minor=True)
+    ax.set_yticklabels(labels, minor=True, fontsize=fontsize)
+    ax.tick_params(which='minor', length=0, pad=pad)
+
+
 def set_flat_labels(ax, x, n_labels=5, axis=1, labelsize=12, rotation=45,
                     formatter='%.3e'):
     """ Helper function to draw the correct x-labels to a flat plot
@@ -233,62 +496,47 @@ def heatmap(x, y, tfs=12, bkg_color='#F1F1F1', separate_first=0, **kwargs):
 
     Based on: https://towardsdatascience.com/better-heatmaps-and-correlation-matrix-plots-in-python-41445d0f2bec
     """
-    if 'color' in kwargs:
-        color = kwargs['color']
-    else:
-        color = [1]*len(x)
+    color = np.asarray(kwargs['color'] if 'color' in kwargs else np.ones(len(x)), dtype=float)
 
     if 'palette' in kwargs:
         palette = kwargs['palette']
-        n_colors = len(palette)
     else:
-        n_colors = 256 # Use 256 colors for the diverging color palette
         palette = sns.diverging_palette(359,122, s=90, n=500) #sns.color_palette("BrBG", n_colors) 
+    n_colors = len(palette)
 
     if 'color_range' in kwargs:
         color_min, color_max = kwargs['color_range']
     else:
-        color_min, color_max = min(color), max(color) # Range of values that will be mapped to the palette, i.e. min and max possible correlation
-
-    def value_to_color(val):
-        if color_min == color_max:
-            return palette[-1]
-        else:
-            val_position = float((val - color_min)) / (color_max - color_min) # position of value in the input range, relative to the length of the input range
-            val_position = min(max(val_position, 0), 1) # bound the position betwen 0 and 1
-            ind = int(val_position * (n_colors - 1)) # target index in the color palette
-            return palette[ind]
+        color_min, color_max = np.min(color), np.max(color) # Range of values that will be mapped to the palette, i.e. min and max possible correlation
 
-    if 'size' in kwargs:
-        size = kwargs['size']
+    # index of each value in the color palette, the position in the input range is bound between 0 and 1
+    colors = mcolors.to_rgba_array(palette)
+    if color_min == color_max:
+        marker_colors = np.repeat(colors[-1:], len(color), axis=0)
     else:
-        size = [1]*len(x)
+        position = np.clip((color - color_min) / (color_max - color_min), 0, 1)
+        marker_colors = colors[(position * (n_colors - 1)).astype(int)]
+
+    size = np.asarray(kwargs['size'] if 'size' in kwargs else np.ones(len(x)), dtype=float)
 
     if 'size_range' in kwargs:
         size_min, size_max = kwargs['size_range'][0], kwargs['size_range'][1]
     else:
-        size_min, size_max = min(size), max(size)
+        size_min, size_max = np.min(size), np.max(size)
 
     size_scale = kwargs.get('size_scale', 500)
 
-    def value_to_size(val):
-        if size_min == size_max:
-            return 1 * size_scale
-        else:
-            val_position = (val - size_min) * 0.99 / (size_max - size_min) + 0.01 # position of value in the input range, relative to the length of the input range
-            val_position = min(max(val_position, 0), 1) # bound the position betwen 0 and 1
-            return val_position * size_scale
-    if 'x_order' in kwargs: 
-        x_names = [t for t in kwargs['x_order']]
+    if size_min == size_max:
+        marker_sizes = np.full(len(size), 1. * size_scale)
     else:
-        x_names = [t for t in sorted(set([v for v in x]))]
-    x_to_num = {p[1]:p[0] for p in enumerate(x_names)}
+        marker_sizes = np.clip((size - size_min) * 0.99 / (size_max - size_min) + 0.01, 0, 1) * size_scale
 
-    if 'y_order' in kwargs: 
-        y_names = [t for t in kwargs['y_order']]
-    else:
-        y_names = [t for t in sorted(set([v for v in y]))]
-    y_to_num = {p[1]:p[0] for p in enumerate(y_names)}
+    # position of each marker from the categorical codes of the names
+    x_names = list(kwargs['x_order']) if 'x_order' in kwargs else sorted(set(x))
+    y_names = list(kwargs['y_order']) if 'y_order' in kwargs else sorted(set(y))
+    x_num = pd.Categorical(x, categories=x_names).codes
+    y_num = pd.Categorical(y, categories=y_names).codes
+    assert np.all(x_num >= 0) and np.all(y_num >= 0), "Not all values of x and y are in x_order and y_order"
 
     plot_grid = plt.GridSpec(1, 30, hspace=0.2, wspace=0.1) # Setup a 1x10 grid
     ax = plt.subplot(plot_grid[:,:-1]) # Use the left 14/15ths of the grid for the main plot
@@ -299,25 +547,25 @@ def heatmap(x, y, tfs=12, bkg_color='#F1F1F1', separate_first=0, **kwargs):
          'color', 'palette', 'color_range', 'size', 'size_range', 'size_scale', 'marker', 'x_order', 'y_order'
     ]}
     ax.scatter(
-        x=[x_to_num[v] for v in x],
-        y=[y_to_num[v] for v in y],
+        x=x_num,
+        y=y_num,
         marker=marker,
-        s=[value_to_size(v) for v in size], 
-        c=[value_to_color(v) for v in color],
+        s=marker_sizes,
+        c=marker_colors,
         **kwargs_pass_on
     )
-    ax.set_xticks([v for k,v in x_to_num.items()])
-    ax.set_xticklabels([k for k in x_to_num], rotation=45, horizontalalignment='right', fontsize=tfs)
-    ax.set_yticks([v for k,v in y_to_num.items()])
-    ax.set_yticklabels([k for k in y_to_num], fontsize=tfs)
+    ax.set_xticks(np.arange(len(x_names)))
+    ax.set_xticklabels(x_names, rotation=45, horizontalalignment='right', fontsize=tfs)
+    ax.set_yticks(np.arange(len(y_names)))
+    ax.set_yticklabels(y_names, fontsize=tfs)
 
     ax.grid(False, 'major')
     ax.grid(True, 'minor')
     ax.set_xticks([t + 0.5 for t in ax.get_xticks()], minor=True)
     ax.set_yticks([t + 0.5 for t in ax.get_yticks()], minor=True)
 
-    ax.set_xlim([-0.5, max([v for v in x_to_num.values()]) + 0.5])
-    ax.set_ylim([-0.5, max([v for v in y_to_num.values()]) + 0.5])
+    ax.set_xlim([-0.5, len(x_names) - 0.5])
+    ax.set_ylim([-0.5, len(y_names) - 0.5])
     ax.set_facecolor(bkg_color)
     
     if separate_first:
@@ -359,12 +607,13 @@ def corrplot(data, size_scale=500, marker='s',tfs=12,
 
     Based on: https://towardsdatascience.com/better-heatmaps-and-correlation-matrix-plots-in-python-41445d0f2bec
     """
-    corr = pd.melt(data.reset_index(), id_vars='index')
-    corr.columns = ['x', 'y', 'value']
+    # one marker per cell, column by column as pd.melt
+    n_rows, n_cols = np.shape(data)
+    values = np.asarray(data.values, dtype=float).T.ravel()
     heatmap(
-        corr['x'], corr['y'],
-        color=corr['value'], color_range=[-1, 1],
-        size=corr['value'].abs(), size_range=[0,1],
+        np.tile(data.index, n_cols), np.repeat(data.columns, n_rows),
+        color=values, color_range=[-1, 1],
+        size=np.abs(values), size_range=[0,1],
         marker=marker,
         x_order=data.columns,
         y_order=data.columns[::-1],
@@ -373,3 +622,271 @@ def corrplot(data, size_scale=500, marker='s',tfs=12,
         separate_first=separate_first,
        *args,**kwargs
     )
+
+
+class CorrelationAccumulator:
+    """ Pearson or Spearman correlation matrix of DataFrame columns, filled chunk by chunk
+
+    Pearson: the weighted sums, squared sums and cross products of all pairs of columns are accumulated with a few
+    matrix products per chunk. The values are shifted by the mean of the first chunk, which keeps the sums small.
+
+    Spearman: each column is digitized into nbins equal-frequency bins, with open bins below and above. The weighted
+    2D histograms of the bins of all pairs of columns are accumulated. In the end each bin gets the mid rank of its
+    entries and the correlation of the ranks is computed from the histograms. Entries in the same bin count as ties,
+    so the result approaches the exact Spearman correlation for fine bins. By default the bin edges are taken from the
+    first chunk, which only works if it is representative of the data, e.g. not for chunks sorted by a column. corr
+    warns if the open bins end up with much more weight than in the first chunk. Otherwise the edges can be given,
+    e.g. as QuantileSketch of each column filled in a previous pass.
+
+    NaN are excluded per pair of columns, as in DataFrame.corr.
+
+    Args:
+        method: 'pearson' or 'spearman'
+        nbins: number of equal-frequency bins per column for 'spearman'
+        columns: (optional) columns to use, by default all numeric columns of the first chunk except the weights
+        edges: (optional) for 'spearman', one entry per column: an array with at most nbins - 1 inner bin edges, or
+            a QuantileSketch (or WindowedQuantileSketch) from which nbins equal-frequency bins are taken
+
+    Examples:
+        >>> acc = CorrelationAccumulator('spearman')
+        >>> for chunk in pd.read_csv("ntuple.csv", chunksize=10**6):
+        ...     acc.fill(chunk, weights='w')
+        >>> b2plot.correlations.corrplot(acc.corr())
+
+    """
+
+    def __init__(self, method='pearson', nbins=64, columns=None, edges=None):
+        assert method in ('pearson', 'spearman'), "Please use method 'pearson' or 'spearman'"
+        self.method = method
+        self.nbins = nbins
+        self.columns = None if columns is None else list(columns)
+        self.entries = 0
+        # pairwise sums, element [i, j] is taken over the entries where column i and j are not NaN
+        self.shift = None
+        self.sumw = self.sumwx = self.sumwxx = self.sumwxy = None
+        # inner bin edges of each column, the 2D histograms of all pairs i < j and the histogram of each column
+        self.edges = None if edges is None else [_inner_edges(e, nbins) if hasattr(e, 'percentile')
+                                                 else np.asarray(e, dtype=float) for e in edges]
+        assert self.edges is None or all(len(e) < nbins for e in self.edges), \
+            "Please provide at most nbins - 1 bin edges per column"
+        self.joint = None
+        self.marginals = None
+        # weight fractions of the open bins below and above the edges in the first chunk, if the edges are taken from it
+        self.end_fractions = None
+
+    def fill(self, data, weights=None):
+        """ Add a DataFrame chunk, or an iterable of chunks, to the correlation matrix
+
+        Args:
+            data: DataFrame chunk or an iterable (e.g. pandas chunk reader) of those, which can also yield
+                (chunk, weights) tuples
+            weights: weights of the chunk, or the name of the weight column
+
+        Returns:
+            self
+
+        """
+        if isinstance(data, pd.DataFrame):
+            self._fill_chunk(data, weights)
+            return self
+
+        for chunk in data:
+            if isinstance(chunk, tuple):
+                chunk, chunk_weights = chunk
+            else:
+                chunk_weights = weights
+            self._fill_chunk(chunk, chunk_weights)
+        return self
+
+    def _fill_chunk(self, df, weights=None):
+        if self.columns is None:
+            self.columns = [c for c in df.select_dtypes('number').columns
+                            if not (isinstance(weights, str) and c == weights)]
+        if isinstance(weights, str):
+            weights = df[weights].values
+        values = df[self.columns].to_numpy(dtype=float)
+        if weights is not None:
+            weights = np.asarray(weights, dtype=float)
+            assert len(weights) == len(values), "Weights and data length does not match"
+        if not len(values):
+            return
+
+        if self.method == 'pearson':
+            self._fill_moments(values, np.ones(len(values)) if weights is None else weights)
+        else:
+            self._fill_ranks(values, weights)
+        self.entries += len(values)
+
+    def _fill_moments(self, values, weights):
+        if self.shift is None:
+            # columns without values get no shift
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                self.shift = np.nan_to_num(np.nanmean(values, axis=0))
+            n = len(self.columns)
+            self.sumw, self.sumwx, self.sumwxx, self.sumwxy = [np.zeros((n, n)) for _ in range(4)]
+
+        valid = ~np.isnan(values)
+        x = np.where(valid, values - self.shift, 0.)
+        valid = valid.astype(float)
+        wx = weights[:, None] * x
+        self.sumw += (weights[:, None] * valid).T @ valid
+        self.sumwx += wx.T @ valid
+        self.sumwxx += (wx * x).T @ valid
+        self.sumwxy += wx.T @ x
+
+    def _fill_ranks(self, values, weights):
+        n = len(self.columns)
+        first_chunk = self.edges is None
+        if first_chunk:
+            self.edges = [_inner_edges(values[:, i], self.nbins) for i in range(n)]
+        assert len(self.edges) == n, "Please provide bin edges for each column"
+        if self.joint is None:
+            # the last bin holds the NaN
+            self.joint = np.zeros((n * (n - 1) // 2, self.nbins + 1, self.nbins + 1))
+            self.marginals = np.zeros((n, self.nbins + 1))
+
+        codes = np.empty(values.shape, dtype=np.intp)
+        for i in range(n):
+            codes[:, i] = np.searchsorted(self.edges[i], values[:, i], side='right')
+            codes[np.isnan(values[:, i]), i] = self.nbins
+            self.marginals[i] += np.bincount(codes[:, i], weights=weights, minlength=self.nbins + 1)
+        if first_chunk:
+            self.end_fractions = self._end_fractions()
+
+        # one bincount per column with all pairs of the columns after it, in blocks of rows to keep the index small
+        size = (self.nbins + 1)**2
+        for start in range(0, len(codes), BLOCK_SIZE):
+            block = codes[start:start + BLOCK_SIZE]
+            first = 0
+            for i in range(n - 1):
+                index = block[:, i:i + 1] * (self.nbins + 1) + block[:, i + 1:] + np.arange(n - i - 1) * size
+                # the entries of a row are one after the other, each with the weight of the row
+                pair_weights = None if weights is None else np.repeat(weights[start:start + BLOCK_SIZE], n - i - 1)
+                counts = np.bincount(index.ravel(), weights=pair_weights, minlength=(n - i - 1) * size)
+                self.joint[first:first + n - i - 1] += counts.reshape(-1, self.nbins + 1, self.nbins + 1)
+                first += n - i - 1
+
+    def __iadd__(self, other):
+        """ Add another accumulator, e.g. of another worker. For 'spearman' both need the same bin edges, i.e. be
+        copies of one accumulator filled with a first chunk.
+        """
+        assert self.method == other.method, "Only accumulators of the same method can be added"
+        if other.entries == 0:
+            return self
+        if self.entries == 0:
+            assert self.columns in (None, other.columns), "Only accumulators of the same columns can be added"
+            self.__dict__.update({k: v.copy() if isinstance(v, np.ndarray) else v for k, v in other.__dict__.items()})
+            return self
+        assert self.columns == other.columns, "Only accumulators of the same columns can be added"
+
+        if self.method == 'pearson':
+            # sums of the other accumulator around the shift of this one
+            d = (other.shift - self.shift)[:, None]
+            w, wx = other.sumw, other.sumwx
+            self.sumw += w
+            self.sumwx += wx + d * w
+            self.sumwxx += other.sumwxx + 2 * d * wx + d * d * w
+            self.sumwxy += other.sumwxy + d.T * wx + d * wx.T + d * d.T * w
+        else:
+            assert all(np.array_equal(a, b) for a, b in zip(self.edges, other.edges)), \
+                "Only accumulators with the same bin edges (copies of one filled accumulator) can be added"
+            self.joint += other.joint
+            self.marginals += other.marginals
+        self.entries += other.entries
+        return self
+
+    def corr(self):
+        """ Correlation matrix as DataFrame, as DataFrame.corr
+
+        Returns:
+            DataFrame with the columns as index and columns, which can be drawn with corrmatrix or corrplot
+        """
+        assert self.entries > 0, "Please fill the accumulator first"
+        if self.method == 'pearson':
+            matrix = self._pearson()
+        else:
+            matrix = self._spearman()
+        return pd.DataFrame(matrix, index=self.columns, columns=self.columns)
+
+    def _pearson(self):
+        w, sx = self.sumw, self.sumwx
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cov = self.sumwxy - sx * sx.T / w
+            var_x = self.sumwxx - sx * sx / w
+            matrix = cov / np.sqrt(var_x * var_x.T)
+        return np.clip(matrix, -1, 1)
+
+    def _end_fractions(self):
+        """ Weight fractions of the open bins below and above the edges of each column, shape (n_vars, 2)
+        """
+        ends = np.array([[m[0], m[len(e)]] for m, e in zip(self.marginals, self.edges)])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.nan_to_num(ends / self.marginals[:, :-1].sum(axis=1)[:, None])
+
+    def _spearman(self):
+        if self.end_fractions is not None:
+            # much more weight than in the first chunk, at least 4/nbins, means that the data are not covered
+            limit = 4 * np.maximum(self.end_fractions, 1. / self.nbins)
+            uncovered = [c for c, above in zip(self.columns, (self._end_fractions() > limit).any(axis=1)) if above]
+            if uncovered:
+                warnings.warn("The bin edges of the first chunk do not cover the data of %s, the Spearman correlation "
+                              "is inaccurate. Please shuffle the chunks or provide the edges." % ", ".join(
+                                  str(c) for c in uncovered))
+
+        n = len(self.columns)
+        # 1 on the diagonal, NaN for columns without values or with a single value, as in DataFrame.corr
+        matrix = np.diag([_rank_correlation(np.diag(m[:-1])) for m in self.marginals])
+        first = 0
+        for i in range(n - 1):
+            for j in range(i + 1, n):
+                matrix[i, j] = matrix[j, i] = _rank_correlation(self.joint[first][:-1, :-1])
+                first += 1
+        return matrix
+
+
+def _inner_edges(x, nbins):
+    """ Inner edges of nbins equal-frequency bins of an array with NaN or of a QuantileSketch
+    """
+    fractions = np.arange(1, nbins) / nbins
+    if hasattr(x, 'percentile'):
+        edges = np.asarray(x.percentile(100 * fractions), dtype=float)
+        return pd.unique(edges[~np.isnan(edges)])
+    if not np.isfinite(x).any():
+        return np.empty(0)
+    return pd.unique(np.nanpercentile(x, 100 * fractions))
+
+
+def _rank_correlation(joint):
+    """ Pearson correlation of the mid ranks of the bins of a weighted 2D histogram
+    """
+    total = joint.sum()
+    marginals = joint.sum(axis=1), joint.sum(axis=0)
+    ranks = [np.cumsum(m) - m / 2. - total / 2. for m in marginals]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = ranks[0] @ joint @ ranks[1]
+        return cov / np.sqrt(np.dot(marginals[0], ranks[0]**2) * np.dot(marginals[1], ranks[1]**2))
+
+
+def correlation_matrix(data, method='pearson', weights=None, nbins=64, columns=None, edges=None):
+    """ Pearson or Spearman correlation matrix in one streaming pass, see CorrelationAccumulator
+
+    Args:
+        data: DataFrame, iterable of DataFrame chunks or Parquet file (read one row group at a time)
+        method: 'pearson' or 'spearman'
+        weights: (optional) weights, or the name of the weight column
+        nbins: number of equal-frequency bins per column for 'spearman'
+        columns: (optional) columns to use, by default all numeric columns except the weights
+        edges: (optional) bin edges or QuantileSketch of each column for 'spearman', see CorrelationAccumulator
+
+    Returns:
+        DataFrame, which can be drawn with corrmatrix or corrplot
+
+    Examples:
+        >>> b2plot.correlations.corrplot(b2plot.correlation_matrix("ntuple.parquet", 'spearman', weights='w'))
+
+    """
+    if is_parquet_path(data):
+        assert columns is not None, "Please provide the columns of the Parquet file"
+        data = read_parquet(data, list(columns) + ([weights] if isinstance(weights, str) else []), chunked=True)
+    return CorrelationAccumulator(method, nbins, columns, edges).fill(data, weights).corr()
@@ -35,7 +35,7 @@ def draw_y_label(label='Entries', unit=None, ha='right', brackets=True,ax=None,
         br_open = ' ['
         br_close = ']'
 
-    x_axis = manager.get_x_axis()
+    x_axis = manager.get_x_axis(ax)
     if unit is None:
         ax.set_ylabel(label, ha=ha, *args, **kwargs)
     else:
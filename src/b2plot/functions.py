@@ -10,23 +10,34 @@ import matplotlib.pyplot as plt
 from .helpers import TheManager
 
 
+def has_nans(data):
+    """ Check for NaN without creating a temporary array of the size of data
+
+    The sum of the data is only NaN or infinite if there are NaN or infinite values, only then the elements are
+    checked one by one.
+    """
+    data = np.asarray(data)
+    if data.dtype.kind in 'iub':
+        return False
+    return not np.isfinite(np.sum(data)) and bool(np.isnan(data).any())
+
+
 def remove_nans(data, weights=None, stacked=False):
     """
     Remove NaN elements in data array, and corresponding weights too.
+
+    Arrays without NaN are returned as they are, without a copy.
     """
 
-    if not stacked:
-        data_new = data[~np.isnan(data)]
-    else:
-        data_new = [d[~np.isnan(d)] for d in data]
-    weights_new = None
-    if weights is not None:
-        if not stacked:
-            weights_new = weights[~np.isnan(data)]
-        else:
-            weights_new = [w[~np.isnan(data[idx])] for idx, w in enumerate(weights)]
+    if stacked:
+        cleaned = [remove_nans(d, None if weights is None else weights[idx]) for idx, d in enumerate(data)]
+        return [d for d, _ in cleaned], None if weights is None else [w for _, w in cleaned]
+
+    if not has_nans(data):
+        return data, weights
 
-    return data_new, weights_new
+    keep = ~np.isnan(data)
+    return np.asarray(data)[keep], None if weights is None else np.asarray(weights)[keep]
 
 
 def clip_data(data, bins=None, x_range=None):
@@ -61,11 +72,12 @@ def xlim(low=None, high=None, ax=None):
 
     """
 
-    xaxis = TheManager.Instance().get_x_axis()
+    if ax is None:
+        ax = plt.gca()
+
+    xaxis = TheManager.Instance().get_x_axis(ax)
 
     if xaxis is not None:
-        if ax is None:
-            ax = plt.gca()
         ax.set_xlim(np.min(xaxis), np.max(xaxis))
     if low is not None or high is not None:
         ax.set_xlim(low, high)
@@ -4,6 +4,9 @@ Helper function and classes are defined here.
 
 """
 
+import threading
+import weakref
+
 import b2plot
 # from .functions import bar
 
@@ -92,39 +95,142 @@ class Singleton:
         return isinstance(inst, self._decorated)
 
 
-@Singleton
-class TheManager:
+class _ThreadState(threading.local):
+    """ State of TheManager which is separate for each thread
+    """
+
     def __init__(self):
         self.xaxis = None
         self.toreplot = []
+        self.deferred = False
+        self.specs = []
+
+
+def _thread_attribute(name):
+    return property(lambda self: getattr(self._state, name), lambda self, value: setattr(self._state, name, value))
+
+
+@Singleton
+class TheManager:
+    """ Binning and plotting state
 
-    def get_x_axis(self):
+    The bin edges used by the histogram functions are stored for each matplotlib Axes, so every axes keeps its own
+    binning. set_x_axis without axes sets the binning of the current pyplot axes, the default of the current thread
+    is only used while there are no axes yet. All other state is kept per thread as well, so several threads can
+    plot into their own axes at the same time.
+
+    """
+
+    xaxis = _thread_attribute('xaxis')
+    toreplot = _thread_attribute('toreplot')
+    deferred = _thread_attribute('deferred')
+    specs = _thread_attribute('specs')
+
+    def __init__(self):
+        self._state = _ThreadState()
+        self._axes = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _current_axes():
+        """ Current pyplot axes, None if there are none yet. Unlike plt.gca no axes are created.
+        """
+        if not plt.get_fignums() or not plt.gcf().axes:
+            return None
+        return plt.gca()
+
+    def get_x_axis(self, ax=None):
+        """ Bin edges of the given axes, or of the current pyplot axes if there are any
+
+        Falls back to the default of the current thread if the axes have no binning yet.
+        """
+        if ax is None:
+            ax = self._current_axes()
+        if ax is not None:
+            with self._lock:
+                xaxis = self._axes.get(ax)
+            if xaxis is not None:
+                return xaxis
         return self.xaxis
 
-    def set_x_axis(self, axis):
-        self.xaxis = axis
+    def set_x_axis(self, axis, ax=None):
+        """ Store the bin edges for the given axes, without axes for the current pyplot axes
+
+        If there are no axes yet, the bin edges are stored as default of the current thread.
+        """
+        if ax is None:
+            ax = self._current_axes()
+        if ax is None:
+            self.xaxis = axis
+            return
+        with self._lock:
+            if axis is None:
+                self._axes.pop(ax, None)
+            else:
+                self._axes[ax] = axis
 
     def figure(self, *args, **kwargs):
         # f = plt.figure(tight_layout={'pad': 0})
         f = plt.figure(*args, **kwargs)
         self.xaxis = None
         self.toreplot = []
+        self.specs = []
         return f
 
+    def defer(self, deferred=True):
+        """ Switch the deferred mode on or off
+
+        In deferred mode hist, stacked and errorhist only bin their data and record what to draw, nothing is drawn
+        until render is called.
+
+        """
+        self.deferred = deferred
+
+    def record(self, func, **kwargs):
+        """ Store a drawing call for render, the current axes are stored with it
+        """
+        if kwargs.get('ax') is None:
+            kwargs['ax'] = plt.gca()
+        self.specs.append((func, kwargs))
+
+    def render(self, ax=None, **style):
+        """ Draw all recorded plots
+
+        The recorded plots are kept, so they can be drawn again, e.g. into another figure or with another style.
+
+        Args:
+            ax: (optional) draw everything into these axes instead of the recorded ones
+            **style: replace recorded arguments, e.g. lw=2
+
+        Returns:
+            list with the return value of each drawing call
+
+        """
+        deferred, self.deferred = self.deferred, False
+        drawn = []
+        try:
+            for func, kwargs in self.specs:
+                kwargs = dict(kwargs, **{key: value for key, value in style.items() if key in kwargs})
+                if ax is not None:
+                    kwargs['ax'] = ax
+                drawn.append(func(**kwargs))
+        finally:
+            self.deferred = deferred
+        return drawn
+
     def add_replot(self, h):
         self.toreplot.append(h)
 
     def  replot(self, ecolor='black'):
         for h in self.toreplot:
-
-            b2plot.bar(h[0], h[1], lw=1, histtype='step', color='black' )
+            b2plot.histogram.hist_from_counts(h[0], h[1], lw=1, color=ecolor)
 
 
 manager = TheManager.Instance()
 
 
-def xaxis():
-    return TheManager.Instance().get_x_axis()
+def xaxis(ax=None):
+    return TheManager.Instance().get_x_axis(ax)
 
 
 def nf():
@@ -134,6 +240,15 @@ def nf():
 def figure(*args, **kwargs):
     return TheManager.Instance().figure(*args, **kwargs)
 
+
+def defer(deferred=True):
+    TheManager.Instance().defer(deferred)
+
+
+def render(ax=None, **style):
+    return TheManager.Instance().render(ax, **style)
+
+
 def replot():
     print("replotting")
     TheManager.Instance().replot()
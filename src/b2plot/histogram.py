@@ -8,6 +8,10 @@ In this file all the histogram related functions.
 from .helpers import get_optimal_bin_size, TheManager
 from .colors import b2cm
 from .functions import remove_nans, clip_data
+from .accumulator import HistAccumulator
+from .cache import cached_fill, cached_fill_grouped
+from .quantiles import percentile_edges
+from .sources import is_source, iter_chunks, source_range, read_parquet, is_parquet_path, ParquetColumn
 import pandas as pd
 import numpy as np
 from matplotlib.colors import hex2color
@@ -15,40 +19,50 @@ from matplotlib.colors import hex2color
 import matplotlib.pyplot as plt
 
 
-def _hist_init(data, bins=None, xrange=None):
+def _hist_init(data, bins=None, xrange=None, ax=None):
     """ Performs and stores or returns the binning
 
     Args:
         data:
         bins:
         xrange:
+        ax: axes whose binning is reused
 
     Returns:
 
     """
-    xaxis = TheManager.Instance().get_x_axis()
+    xaxis = TheManager.Instance().get_x_axis(ax)
 
     if xaxis is None or bins is not None or xrange is not None:
         if bins is None:
             bins = get_optimal_bin_size(len(data))
+        if np.ndim(bins) == 0 and not is_source(data):
+            # the range is taken from the data, NaN are only removed here, the binning skips them
+            data, _ = remove_nans(data)
+        if is_source(data):
+            # only the range is needed, which is read without loading the column
+            scan = np.ndim(bins) == 0 and xrange in (None, 'auto')
+            data = np.array([v for v in source_range(data) if not np.isnan(v)] if scan else [], dtype=float)
         if xrange == 'auto':
             from .analysis import minmax
             xrange = minmax(data)
-        _, xaxis = np.histogram(data, bins, xrange)
+        xaxis = np.histogram_bin_edges(data, bins, xrange)
 
-    return xaxis
+    return np.asarray(xaxis)
 
 
-def set_xaxis(bins, flat=False):
-    TheManager.Instance().set_x_axis(bins)
+def set_xaxis(bins, flat=False, ax=None):
+    TheManager.Instance().set_x_axis(bins, ax)
 
 
-def get_xaxis():
-    return TheManager.Instance().get_x_axis()
+def get_xaxis(ax=None):
+    return TheManager.Instance().get_x_axis(ax)
 
 
 def flat_x(x, nbins=25):
-    set_xaxis(np.percentile(x, np.linspace(0, 100, nbins)))
+    """ Use an equal-frequency binning of x, which can also be a QuantileSketch or a list of them
+    """
+    set_xaxis(percentile_edges(x, nbins))
 
 
 # This needs to be changed
@@ -57,11 +71,12 @@ STYLES_hatches = [None, '///', r"\\\ ",  'xxx', '--', '++', 'o', ".+", 'xx', '//
 
 
 def hist(data, bins=None, fill=False, range=None, lw=1., ax=None, style=None, color=None, scale=None, weights=None,
-         label=None, edgecolor=None, fillalpha=0.5, paint_uoflow=False, *args, **kwargs):
+         label=None, edgecolor=None, fillalpha=0.5, paint_uoflow=False, n_threads=None, *args, **kwargs):
     """
 
     Args:
-        data:
+        data: array, Series, a filled HistAccumulator or a column source (memmap, pyarrow array, ParquetColumn),
+            which is filled chunk by chunk
         bins:
         fill:
         range:
@@ -72,6 +87,7 @@ def hist(data, bins=None, fill=False, range=None, lw=1., ax=None, style=None, co
         scale:
         weights:
         paint_uoflow: draw u/oflow content in first/last visible bin. Requires bins to be an iterable.
+        n_threads: (optional) number of threads used to fill the histogram, by default the setting of set_threads
         *args:
         **kwargs:
 
@@ -79,16 +95,103 @@ def hist(data, bins=None, fill=False, range=None, lw=1., ax=None, style=None, co
 
     """
 
+    if is_source(data):
+        data = _fill_source(data, weights, bins, range, paint_uoflow, ax, n_threads)
+
     if type(data) is pd.Series:
         data = data.values
 
     if type(weights) is pd.Series:
         weights = weights.values
 
-    data, weights = remove_nans(data, weights)
+    # applied to the bin contents, not to each entry
+    scale = _scale_factor(scale)
+
+    if ax is None:
+        ax = plt.gca()
+
+    if isinstance(data, HistAccumulator):
+        # already binned, the contents are drawn as they are
+        xaxis, contents = data.edges, data.sumw
+    else:
+        if paint_uoflow:
+            data = clip_data(data, bins=bins, x_range=range)
+        xaxis = _hist_init(data, bins, xrange=range, ax=ax)
+        _, contents = _binned(data, xaxis, weights, n_threads)
+
+    y, xaxis, patches = hist_from_counts(contents, xaxis, fill=fill, lw=lw, ax=ax, style=style, color=color,
+                                         scale=scale, label=label, edgecolor=edgecolor, fillalpha=fillalpha, *args,
+                                         **kwargs)
+
+    TheManager.Instance().set_x_axis(xaxis, ax)
+    return y, xaxis, patches
+
+
+def _stairs(ax, values, edges, *args, baseline=0, fill=False, **kwargs):
+    """ ax.stairs, drawn with ax.hist for matplotlib versions before 3.4 which do not have it
+    """
+    if hasattr(ax, 'stairs'):
+        return ax.stairs(values, edges, *args, baseline=baseline, fill=fill, **kwargs)
+    _, _, patches = ax.hist(edges[:-1], edges, *args, weights=values - baseline, bottom=baseline,
+                            histtype='stepfilled' if fill else 'step', **kwargs)
+    return patches[0]
 
-    if weights is None:
-        weights = np.ones(len(data))
+
+def hist_from_counts(counts, edges, sumw2=None, fill=False, lw=1., ax=None, style=None, color=None, scale=None,
+                     label=None, edgecolor=None, fillalpha=0.5, density=False, cumulative=False, bottom=0, log=False,
+                     err_alpha=0.3, *args, **kwargs):
+    """ Draw an already binned histogram, with the same styles as hist
+
+    The bin contents are drawn directly as steps, nothing is binned again. This is the cheap way to plot the
+    content of a HistAccumulator or of a stored histogram.
+
+    Args:
+        counts: bin contents
+        edges: bin edges, len(counts) + 1
+        sumw2: (optional) sum of squared weights per bin, draws a band of +-sqrt(sumw2) around the contents
+        fill:
+        lw:
+        ax:
+        style:
+        color:
+        scale: (optional) int or float the contents are multiplied with
+        label:
+        edgecolor:
+        fillalpha:
+        density: normalise the contents to unit area
+        cumulative: draw the cumulative distribution, reversed if negative
+        bottom: baseline of the histogram
+        log: logarithmic y-axis
+        err_alpha: opacity of the uncertainty band
+        *args:
+        **kwargs: passed on to ax.stairs, or ax.hist for matplotlib < 3.4
+
+    Returns:
+        y, edges, patches
+
+    """
+    edges = np.asarray(edges, dtype=float)
+    y = np.array(counts, dtype=float)
+    err = None if sumw2 is None else np.sqrt(np.asarray(sumw2, dtype=float))
+    if scale is not None and not isinstance(scale, bool):
+        y *= scale
+        err = None if err is None else err * abs(scale)
+    if density:
+        norm = y.sum() * np.diff(edges)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            y = y / norm
+            err = None if err is None else err / norm
+    if cumulative:
+        slc = slice(None, None, -1) if cumulative < 0 else slice(None)
+        y = (y * np.diff(edges) if density else y)[slc].cumsum()[slc]
+
+    manager = TheManager.Instance()
+    if manager.deferred:
+        assert not args, "Please use keyword arguments in deferred mode"
+        manager.record(hist_from_counts, counts=counts, edges=edges, sumw2=sumw2, fill=fill, lw=lw, ax=ax, style=style,
+                       color=color, scale=scale, label=label, edgecolor=edgecolor, fillalpha=fillalpha,
+                       density=density, cumulative=cumulative, bottom=bottom, log=log, err_alpha=err_alpha, **kwargs)
+        return y, edges, None
 
     if ax is None:
         ax = plt.gca()
@@ -110,34 +213,132 @@ def hist(data, bins=None, fill=False, range=None, lw=1., ax=None, style=None, co
     else:
         style = 0
 
-    if scale is not None:
-        if isinstance(scale, int) or isinstance(scale, float):
-            if not isinstance(scale, bool):
-                weights *= scale
-        else:
-            print("Please provide int or float with scale")
-
     edgecolor = color if edgecolor is None else edgecolor
 
-    if paint_uoflow:
-        data = clip_data(data, bins=bins, x_range=range)
-
-    xaxis = _hist_init(data, bins, xrange=range)
-
     if fill:
-        # edgecolor = 'black' if style == 0 else color
         fc = (*color, fillalpha) if style == 0 else 'none'
-        # y, xaxis, _ = ax.hist(data, xaxis, range=range, histtype='step',
-        #                       lw=lw, color=color, weights=weights, *args, **kwargs)
-        y, xaxis, patches = ax.hist(data, xaxis, range=range, lw=lw, histtype='stepfilled', hatch=STYLES_hatches[style],
-                                    edgecolor=edgecolor, facecolor=fc, linewidth=lw, weights=weights, label=label,
-                                    color=color, *args, **kwargs)
+        patch = _stairs(ax, y + bottom, edges, *args, baseline=bottom, fill=True, hatch=STYLES_hatches[style],
+                        color=color, edgecolor=edgecolor, facecolor=fc, linewidth=lw, label=label, **kwargs)
     else:
-        y, xaxis, patches = ax.hist(data, xaxis, range=range, histtype='step', lw=lw, color=color, weights=weights,
-                                    label=label, *args, **kwargs)
+        patch = _stairs(ax, y + bottom, edges, *args, baseline=bottom, lw=lw, color=color, label=label, **kwargs)
+    patches = [patch]
 
-    TheManager.Instance().set_x_axis(xaxis)
-    return y, xaxis, patches
+    if err is not None and not cumulative:
+        patches.append(_stairs(ax, y + bottom + err, edges, baseline=y + bottom - err, fill=True, color=color,
+                               alpha=err_alpha, lw=0))
+    if log:
+        ax.set_yscale('log')
+
+    return y, edges, patches
+
+
+def stacked_from_counts(counts, edges, color=None, lw=.5, ax=None, edgecolor='black', label=None, *args, **kwargs):
+    """ Draw already binned histograms stacked on top of each other, with the same style as stacked
+
+    Args:
+        counts: list of bin contents or 2D array (component, bin), the first component is at the bottom
+        edges: bin edges
+        color: list of colors, by default b2helix
+        lw:
+        ax:
+        edgecolor:
+        label: list of labels
+        *args:
+        **kwargs: passed on to ax.stairs, or ax.hist for matplotlib < 3.4
+
+    Returns:
+        cumulative contents (component, bin), edges, patches
+
+    """
+    edges = np.asarray(edges, dtype=float)
+    tops = np.cumsum(np.atleast_2d(np.asarray(counts, dtype=float)), axis=0)
+    bottoms = np.vstack([np.zeros(len(edges) - 1), tops[:-1]])
+
+    manager = TheManager.Instance()
+    if manager.deferred:
+        assert not args, "Please use keyword arguments in deferred mode"
+        manager.record(stacked_from_counts, counts=counts, edges=edges, color=color, lw=lw, ax=ax,
+                       edgecolor=edgecolor, label=label, **kwargs)
+        return tops, edges, None
+
+    if ax is None:
+        ax = plt.gca()
+
+    if color is None and len(tops) < 20:
+        from b2plot.colors import b2helix
+        color = b2helix(len(tops))
+    if label is None or isinstance(label, str):
+        label = [label] + [None] * (len(tops) - 1)
+
+    # drawn from the top, as in ax.hist, so the legend lists the top component first
+    patches = []
+    for i in reversed(list(np.arange(len(tops)))):
+        style = {} if color is None else {'color': color[i]}
+        patches.append(_stairs(ax, tops[i], edges, *args, baseline=bottoms[i], fill=True, lw=lw, edgecolor=edgecolor,
+                               label=label[i], **style, **kwargs))
+    patches.reverse()
+
+    return tops, edges, patches
+
+
+def _binned(data, xaxis, weights=None, n_threads=None):
+    """ Bin centers and bin contents of data
+    """
+    contents, _, _ = cached_fill(data, xaxis, weights, n_threads)
+    return bc(xaxis), contents
+
+
+def _fill_source(data, weights=None, bins=None, range=None, paint_uoflow=False, ax=None, n_threads=None):
+    """ HistAccumulator filled chunk by chunk from a column source (memmap, pyarrow array or ParquetColumn)
+    """
+    acc = HistAccumulator(_hist_init(data, bins, xrange=range, ax=ax))
+    for values, chunk_weights in iter_chunks(data, weights):
+        if paint_uoflow:
+            values = clip_data(values, bins=bins, x_range=range)
+        acc.fill(values, chunk_weights, n_threads=n_threads)
+    return acc
+
+
+def _stack_source(path, col, by, weights=None, bins=None, range=None, paint_uoflow=False, order_func=len, ax=None,
+                  n_threads=None):
+    """ One HistAccumulator per category of a Parquet file, filled one row group at a time
+
+    The binning is determined from the range of the full column.
+
+    Returns:
+        list of HistAccumulator, categories
+
+    """
+    assert order_func in (len, None), "Only len or None can be used as order_func for Parquet files"
+    by_columns = [by] if isinstance(by, str) else list(by)
+    columns = [col] + by_columns + ([weights] if weights else [])
+
+    xaxis = _hist_init(ParquetColumn(path, col), bins, xrange=range, ax=ax)
+    accumulators = {}
+    for chunk in read_parquet(path, columns, chunked=True):
+        if paint_uoflow:
+            chunk[col] = clip_data(chunk[col].values, bins=bins, x_range=range)
+        for cat, group in chunk.groupby(by):
+            if cat not in accumulators:
+                accumulators[cat] = HistAccumulator(xaxis)
+            accumulators[cat].fill(group[col].values, None if not weights else group[weights].values,
+                                   n_threads=n_threads)
+
+    cats = sorted(accumulators)
+    if order_func is not None:
+        cats = sorted(cats, key=lambda cat: accumulators[cat].entries)
+    return [accumulators[cat] for cat in cats], np.array(cats)
+
+
+def _scale_factor(scale):
+    """ Scale factor of hist and errorhist, 1 if scale is not an int or float
+    """
+    if scale is None or isinstance(scale, bool):
+        return 1
+    if isinstance(scale, int) or isinstance(scale, float):
+        return scale
+    print("Please provide int or float with scale")
+    return 1
 
 
 def _notransform(x):
@@ -148,7 +349,7 @@ def to_stack(df, col, by, transform=None, get_cats=False, stack_weights=False, o
     """ Convert columns of a dataframe to a list of lists by 'by'
 
     Args:
-        df:
+        df: DataFrame or Parquet file, of which only the needed columns are read
         col:
         by:
         transform:
@@ -159,6 +360,10 @@ def to_stack(df, col, by, transform=None, get_cats=False, stack_weights=False, o
 
     """
 
+    if is_parquet_path(df):
+        by_columns = [by] if isinstance(by, str) else list(by)
+        df = read_parquet(df, [col] + by_columns + ([stack_weights] if stack_weights else []))
+
     g = df.groupby(by)
     transform = _notransform if transform is None else transform
     x_data = []
@@ -184,11 +389,90 @@ def to_stack(df, col, by, transform=None, get_cats=False, stack_weights=False, o
     return x_data, x_weights
 
 
-def stacked(df, col=None, by=None, bins=None, color=None, range=None, lw=.5, ax=None, edgecolor='black', weights=None, scale=None, label=None, transform=None, paint_uoflow=False, order_func=len, *args, **kwargs):
+def _component_scale(scale, i, n_components, cats=None):
+    """ Scale factor of the i-th component of a stacked histogram
+
+    Args:
+        scale: int or float for all components, dict by category or list (only for list input)
+        i: index of the component
+        n_components: number of components
+        cats: categories of the components, None if the input was a list
+
+    """
+    if scale is None:
+        return 1
+    if isinstance(scale, int) or isinstance(scale, float):
+        return 1 if isinstance(scale, bool) else scale
+    if isinstance(scale, dict):
+        assert cats[i] in scale.keys(), "Scale list must have same lenght as data"
+        return scale[cats[i]]
+    if isinstance(scale, list):
+        assert cats is None, "Scales can be list only if df is list"
+        assert n_components==len(scale), "Your input df list msut be the same length as scales if providing them as list"
+        return scale[i]
+    print("Please provide int, float or list  with scale")
+    return 1
+
+
+def _stack_contents(df, col, by, bins=None, range=None, weights=None, scale=None, paint_uoflow=False, order_func=len,
+                    ax=None, n_threads=None):
+    """ Bin contents of all categories of a stacked histogram with a single pass over the column
+
+    The categories are ordered as in to_stack, by their number of entries if order_func is len.
+
+    Args:
+        df: DataFrame
+        col: column to histogram
+        by: column(s) defining the categories
+        bins:
+        range:
+        weights: (optional) name of the weight column
+        scale: see stacked
+        paint_uoflow:
+        order_func: len or None
+        ax: axes whose binning is reused
+        n_threads: (optional) number of threads used to fill the histograms
+
+    Returns:
+        xaxis, list of bin contents per category, categories
+
+    """
+    g = df.groupby(by)
+    sizes = g.size()
+    cats = np.array([gg for gg in sizes.index])
+    n_groups = len(cats)
+
+    # rows without a category are collected in an extra group, which is not drawn
+    codes = np.asarray(g.ngroup().values, dtype=float)
+    codes[~(codes >= 0)] = n_groups
+    codes = codes.astype(np.intp)
+
+    order = np.arange(n_groups)
+    if order_func is not None:
+        order = sizes.values.argsort()
+    cats = cats[order]
+
+    x = np.asarray(df[col].values)
+    w = None if weights is None else df[weights].values
+    if paint_uoflow:
+        x = clip_data(x, bins=bins, x_range=range)
+
+    xaxis = _hist_init(x[codes == order[0]], bins, xrange=range, ax=ax)
+
+    sumw, _, _ = cached_fill_grouped(x, codes, n_groups + 1, xaxis, w, n_threads)
+    contents = []
+    for i, group in enumerate(order):
+        factor = 1 if weights is not None else _component_scale(scale, i, n_groups, cats)
+        contents.append(sumw[group] * factor)
+    return xaxis, contents, cats
+
+
+def stacked(df, col=None, by=None, bins=None, color=None, range=None, lw=.5, ax=None, edgecolor='black', weights=None, scale=None, label=None, transform=None, paint_uoflow=False, order_func=len, n_threads=None, *args, **kwargs):
     """ Create stacked histogram
 
     Args:
-        df (DataFrame or list of arrays):
+        df (DataFrame, Parquet file, list of arrays, list of column sources or list of HistAccumulator): Parquet
+            files are read one row group at a time
         col:
         by:
         bins:
@@ -196,6 +480,7 @@ def stacked(df, col=None, by=None, bins=None, color=None, range=None, lw=.5, ax=
         lw:
         order_func: Function applied to dataframes after splitting to determine the order in which they are plotted. Return value must be sortable. The function should take a single input which should be a dataframe.
         weights: Weights can be supplied as a column within the dataframe, or as a stacked list appropriately to the input data.
+        n_threads: (optional) number of threads used to fill the histograms, by default the setting of set_threads
         *args:
         **kwargs:
 
@@ -203,6 +488,10 @@ def stacked(df, col=None, by=None, bins=None, color=None, range=None, lw=.5, ax=
 
     """
 
+    if ax is None:
+        ax = plt.gca()
+
+    contents = None
     if isinstance(df, pd.DataFrame):
         assert col is not None, "Please provide column"
         assert by is not None, "Please provide by"
@@ -212,60 +501,67 @@ def stacked(df, col=None, by=None, bins=None, color=None, range=None, lw=.5, ax=
         else:
             stack_weights = False
 
+        if transform is None and order_func in (len, None) and (weights is None or stack_weights):
+            # All categories are binned in one pass over the column
+            xaxis, contents, cats = _stack_contents(df, col, by, bins, range, stack_weights or None, scale,
+                                                    paint_uoflow, order_func, ax, n_threads)
+        else:
+            data, stacked_weights, cats = to_stack(df, col, by, transform, get_cats=True, stack_weights=stack_weights, order_func = order_func)
+            if stack_weights:
+                weights = stacked_weights
 
-        data, stacked_weights, cats = to_stack(df, col, by, transform, get_cats=True, stack_weights=stack_weights, order_func = order_func)
-        if stack_weights:
-            weights = stacked_weights
+        if label is None:
+            label = cats
 
+    elif is_parquet_path(df):
+        assert col is not None, "Please provide column"
+        assert by is not None, "Please provide by"
+        assert transform is None, "transform can not be used with Parquet files"
+        assert weights is None or isinstance(weights, str), "Please provide weights as column name"
+        data, cats = _stack_source(df, col, by, weights, bins, range, paint_uoflow, order_func, ax, n_threads)
+        paint_uoflow = False
+        weights = None
         if label is None:
             label = cats
 
     else:
         assert isinstance(df, list), "Please provide DataFrame or List"
         (data, labels) = (df,[None])
+        if len(df) and all(is_source(d) for d in df):
+            xaxis = _hist_init(df[0], bins, xrange=range, ax=ax)
+            data = [_fill_source(d, None if weights is None else weights[i], xaxis, None, paint_uoflow, ax, n_threads)
+                    for i, d in enumerate(df)]
+            paint_uoflow = False
+            weights = None
+
+    if contents is None:
+        accumulated = None
+        if all(isinstance(d, HistAccumulator) for d in data):
+            accumulated = [acc.sumw for acc in data]
+            bins = data[0].edges
+            data = [acc.bin_centers() for acc in data]
+
+        if paint_uoflow:
+            data = [clip_data(d, bins=bins, x_range=range) for d in data]
+
+        # Make sure data is a Python list at this point.
+        assert isinstance(data, list), f"'data' should be a list(np.array), but now it is of type: {type(data)}"
+
+        xaxis = _hist_init(data[0], bins, xrange=range, ax=ax)
+        if weights is not None:
+            contents = [_binned(d, xaxis, w, n_threads)[1] for d, w in zip(data, weights)]
+        else:
+            # unweighted counts, the scale is applied to the bin contents
+            contents = []
+            for i, d in enumerate(data):
+                factor = _component_scale(scale, i, len(data), cats=None if isinstance(df, list) else cats)
+                counts = _binned(d, xaxis, n_threads=n_threads)[1] if accumulated is None else accumulated[i]
+                contents.append(counts * factor)
 
-    data, weights = remove_nans(data, weights, stacked=True)
+    y, xaxis, stuff = stacked_from_counts(contents, xaxis, color=color, lw=lw, ax=ax, edgecolor=edgecolor, label=label,
+                                          *args, **kwargs)
 
-    if ax is None:
-        ax = plt.gca()
-
-    if color is None:
-        from b2plot.colors import b2helix
-        n_stacks = len(data)
-        if n_stacks < 20:
-            color = b2helix(n_stacks)
-
-    if paint_uoflow:
-        data = [clip_data(d, bins=bins, x_range=range) for d in data]
-
-    # Make sure data is a Python list at this point.
-    assert isinstance(data, list), f"'data' should be a list(np.array), but now it is of type: {type(data)}"
-
-    if weights is None:
-        weights = []
-        for i,d in enumerate(data):
-            wei = np.ones(len(d))
-            if scale is not None:
-                if isinstance(scale, int) or isinstance(scale, float):
-                    if not isinstance(scale, bool):
-                        wei *= scale
-                elif isinstance(scale, dict):
-                    assert cats[i] in scale.keys(), "Scale list must have same lenght as data"
-                    wei *= scale[cats[i]]
-                elif isinstance(scale, list):
-                    assert isinstance(df, list), "Scales can be list only if df is list"
-                    assert len(data)==len(scale), "Your input df list msut be the same length as scales if providing them as list"
-                    wei *= scale[i]
-                else:
-                    print("Please provide int, float or list  with scale")
-            weights.append(wei)
-
-    xaxis = _hist_init(data[0], bins, xrange=range)
-
-    y, xaxis, stuff = ax.hist(data, xaxis, histtype='stepfilled',
-                              lw=lw, color=color, edgecolor=edgecolor, stacked=True, weights=weights, label=label, *args, **kwargs)
-
-    TheManager.Instance().set_x_axis(xaxis)
+    TheManager.Instance().set_x_axis(xaxis, ax)
 
     if (isinstance(y, list) and len(y) > 1) or (isinstance(y, np.ndarray) and y.ndim > 1):
         return y[-1], xaxis, stuff  # The last array is the top stack.
@@ -274,11 +570,13 @@ def stacked(df, col=None, by=None, bins=None, color=None, range=None, lw=.5, ax=
 
 
 def errorhist(data, bins=None, color=None, normed=False, density=False, fmt='.', range=None, scale=None, uncertainty_mode="fancy",
-              x_err=False, box=False, ax=None, weights=None, plot_zero=True, label=None, paint_uoflow=False, *args, **kwargs):
+              x_err=False, box=False, ax=None, weights=None, plot_zero=True, label=None, paint_uoflow=False, n_threads=None,
+              *args, **kwargs):
     """ Histogram as error bar
 
     Args:
-        data:
+        data: array, Series, a filled HistAccumulator or a column source (memmap, pyarrow array, ParquetColumn),
+            which is filled chunk by chunk
         bins:
         color:
         normed:
@@ -286,12 +584,15 @@ def errorhist(data, bins=None, color=None, normed=False, density=False, fmt='.',
         fmt:
         range:
         scale:
+        uncertainty_mode: "fancy" (default), "sumw2" for the square root of the sum of squared weights, which is
+            the correct uncertainty for weighted entries, or anything else for sqrt(N)
         x_err:
         box:
         ax:
         weights:
         plot_zero:
         label:
+        n_threads: (optional) number of threads used to fill the histogram, by default the setting of set_threads
         *args:
         **kwargs:
 
@@ -299,53 +600,59 @@ def errorhist(data, bins=None, color=None, normed=False, density=False, fmt='.',
 
     """
 
+    if is_source(data):
+        data = _fill_source(data, weights, bins, range, paint_uoflow, ax, n_threads)
+
     if type(data) is pd.Series:
         data = data.values
 
-    data, weights = remove_nans(data, weights)
-
-    if weights is None:
-        weights = np.ones(len(data))
-
-    if ax is None:
-        ax = plt.gca()
-
-    if scale is not None:
-        if isinstance(scale, int) or isinstance(scale, float):
-            if not isinstance(scale, bool):
-                weights *= scale
-        else:
-            print("Please provide int or float with scale")
-    else:
-        scale = 1
-
-    if paint_uoflow:
-        data = clip_data(data, bins=bins, x_range=range)
+    # applied to the bin contents, not to each entry
+    scale = _scale_factor(scale)
 
     if (normed and density) or normed:
         print('normed is deprecated and changed by density. Your call has been changed to density=True automatically.')
         density=True
 
-    xaxis = _hist_init(data, bins, xrange=range)
+    if ax is None:
+        ax = plt.gca()
 
-    y, x = np.histogram(data, xaxis, density=density, weights=weights)
+    if isinstance(data, HistAccumulator):
+        # already binned, the contents and squared weights are taken as they are
+        xaxis, sumw, sumw2 = data.edges, data.sumw, data.sumw2
+        x = np.asarray(xaxis, dtype=float)
+    else:
+        if paint_uoflow:
+            data = clip_data(data, bins=bins, x_range=range)
+        xaxis = _hist_init(data, bins, xrange=range, ax=ax)
+
+        # One pass for the weighted contents, the squared weights and the raw counts
+        x = np.asarray(xaxis, dtype=float)
+        sumw, sumw2, _ = cached_fill(data, x, weights, n_threads)
+    if scale != 1:
+        sumw = sumw * scale
+        sumw2 = sumw2 * scale**2
+
+    y = sumw
+    if density:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            y = sumw / np.diff(x) / sumw.sum()
 
     # https://www-cdf.fnal.gov/physics/statistics
     if uncertainty_mode == "fancy":
         err = (-0.5*scale + np.sqrt(np.array((y + 0.25)*scale)), +0.5*scale + np.sqrt(np.array((y + 0.25)*scale)))  # np.sqrt(np.array(y))
+    elif uncertainty_mode == "sumw2":
+        err = np.sqrt(sumw2)
     else:
         err = np.sqrt(np.array(y))*scale
     bin_centers = (x[1:] + x[:-1]) / 2.0
 
-    if isinstance(color, int):
-        color = b2cm[color % len(b2cm)]
-
-    if color is None:
-        color = next(ax._get_lines.prop_cycler)["color"]
-
     if density:
-        yom, x = np.histogram(data, xaxis, weights=weights)
-        err = (np.nan_to_num(np.sqrt(np.array(yom)) *(y/yom)), np.nan_to_num(np.sqrt(np.array(yom)) * (y/yom)))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if uncertainty_mode == "sumw2":
+                err = np.nan_to_num(np.sqrt(sumw2) * (y/sumw))
+            else:
+                err = np.nan_to_num(np.sqrt(sumw) * (y/sumw))
+        err = (err, err)
     if x_err is not False or box:
         x_err = (x[1:]-x[:-1])/2.0
     else:
@@ -353,7 +660,7 @@ def errorhist(data, bins=None, color=None, normed=False, density=False, fmt='.',
 
     errorbar(bin_centers, y, err, x_err, box, plot_zero, fmt, color, ax, label=label, *args, **kwargs)
 
-    TheManager.Instance().set_x_axis(xaxis)
+    TheManager.Instance().set_x_axis(xaxis, ax)
 
     return y, xaxis, bin_centers, err
 
@@ -379,6 +686,13 @@ def errorbar(bin_centers, y, y_err, x_err=None, box=False, plot_zero=True, fmt='
         **kwargs:w
     """
 
+    manager = TheManager.Instance()
+    if manager.deferred:
+        assert not args, "Please use keyword arguments in deferred mode"
+        manager.record(errorbar, bin_centers=bin_centers, y=y, y_err=y_err, x_err=x_err, box=box, plot_zero=plot_zero,
+                       fmt=fmt, color=color, ax=ax, label=label, alpha=alpha, hatch=hatch, **kwargs)
+        return
+
     if ax is None:
         ax = plt.gca()
 
@@ -424,12 +738,11 @@ def bar(y, binedges, ax=None, *args, **kwargs):
         **kwargs:
     """
 
-    if ax is None:
-        ax = plt.gca()
-
-    x = (binedges[1:] + binedges[:-1]) / 2.0
+    fill = kwargs.pop('histtype', 'bar') != 'step'
+    if fill:
+        kwargs.setdefault('fillalpha', 1.)
 
-    return ax.hist(x, bins=binedges, weights=y, *args, **kwargs)
+    return hist_from_counts(y, binedges, fill=fill, ax=ax, *args, **kwargs)
 
 
 def profile(x, y, bins=None, range=None, fmt='.', ax=None, *args, **kwargs):
@@ -452,7 +765,7 @@ def profile(x, y, bins=None, range=None, fmt='.', ax=None, *args, **kwargs):
     if ax is None:
         ax = plt.gca()
 
-    xaxis = _hist_init(x, bins, xrange=range)
+    xaxis = _hist_init(x, bins, xrange=range, ax=ax)
 
     means = scipy.stats.binned_statistic(x, y, bins=xaxis, statistic='mean').statistic
     std = scipy.stats.binned_statistic(x, y, bins=xaxis, statistic=scipy.stats.sem).statistic
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming quantiles for equal-frequency binnings.
+
+The QuantileSketch estimates quantiles of a stream with bounded memory and can be merged, so it also works on data
+split across chunks, files or worker processes.
+
+Examples:
+    >>> sketch = QuantileSketch()
+    >>> for chunk in pd.read_csv("ntuple.csv", chunksize=10**6):
+    ...     sketch.update(chunk.x)
+    >>> b2plot.flat_x(sketch, 25)
+
+"""
+
+from collections import deque
+
+import numpy as np
+
+from .functions import has_nans
+
+
+class QuantileSketch:
+    """ KLL quantile sketch
+
+    Values are stored in a hierarchy of compactors. Level h holds items which represent 2**h values each. A full level
+    is sorted and every second item, starting at a random offset, is promoted to the next level. Lower levels get a
+    capacity which shrinks by a factor 2/3 per level, so the sketch stores about 3k values in total, independent of
+    the number of values seen.
+
+    Accuracy: the rank of an estimated quantile deviates from the requested one by less than rank_error() times the
+    number of values, with 99% probability, i.e. about 1.65% for k=200 and 0.4% for k=1000. As long as no level was
+    compacted (fewer than about k values), the quantiles are exact and identical to np.percentile.
+
+    Args:
+        k: size parameter, larger is more accurate
+        seed: (optional) seed of the random offsets
+
+    """
+
+    def __init__(self, k=200, seed=None):
+        self.k = int(k)
+        self.levels = [np.empty(0)]
+        self.n = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self._rng = np.random.RandomState(seed)
+
+    def __len__(self):
+        return self.n
+
+    def update(self, values):
+        """ Add values to the sketch, NaN are skipped
+
+        Returns:
+            self
+
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        if has_nans(values):
+            values = values[~np.isnan(values)]
+        if not len(values):
+            return self
+
+        self.n += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.levels[0] = np.concatenate((self.levels[0], values))
+        self._compress()
+        return self
+
+    def merge(self, other):
+        """ Add the values of another sketch, e.g. the one of another chunk or worker
+
+        Returns:
+            self
+
+        """
+        self.k = min(self.k, other.k)
+        for level, items in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[level] = np.concatenate((self.levels[level], items))
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def quantile(self, q):
+        """ Estimated quantiles
+
+        Args:
+            q: quantile or array of quantiles between 0 and 1
+
+        Returns:
+            value or array of values, NaN if the sketch is empty
+
+        """
+        q = np.asarray(q, dtype=float)
+        if self.n == 0:
+            return np.full(q.shape, np.nan) if q.ndim else np.nan
+        if len(self.levels) == 1:
+            return np.quantile(self.levels[0], q)
+
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(lvl), 2.0**h) for h, lvl in enumerate(self.levels)])
+        order = np.argsort(items, kind='mergesort')
+        items, cumulative = items[order], np.cumsum(weights[order])
+
+        idx = np.minimum(np.searchsorted(cumulative, q * self.n, side='left'), len(items) - 1)
+        return np.where(q <= 0, self.min, np.where(q >= 1, self.max, items[idx]))
+
+    def percentile(self, p):
+        """ Estimated percentiles, as np.percentile
+        """
+        return self.quantile(np.asarray(p, dtype=float) / 100.)
+
+    def rank_error(self):
+        """ Bound of the normalised rank error (99% confidence)
+
+        Empirical bound of the KLL sketch with compactor capacities shrinking by 2/3 per level, as measured for the
+        Apache DataSketches implementation. 0 while the sketch is still exact.
+        """
+        if len(self.levels) == 1:
+            return 0.
+        return 2.446 / self.k**0.9433
+
+    def _capacity(self, level):
+        return max(int(np.ceil(self.k * (2 / 3.)**(len(self.levels) - level - 1))), 2)
+
+    def _compress(self):
+        while True:
+            full = [level for level, items in enumerate(self.levels) if len(items) > self._capacity(level)]
+            if not full:
+                return
+            level = full[0]
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+
+            items = np.sort(self.levels[level])
+            # with an odd number of items, the smallest one stays on this level
+            kept = len(items) % 2
+            promoted = items[kept + self._rng.randint(2)::2]
+            self.levels[level] = items[:kept]
+            self.levels[level + 1] = np.concatenate((self.levels[level + 1], promoted))
+
+
+class WindowedQuantileSketch:
+    """ Quantiles over the last n_blocks updates, e.g. for online monitoring
+
+    Each update is kept in its own QuantileSketch, the quantiles are estimated from the merged sketches of the
+    window. The oldest block is dropped when a new one is added to a full window.
+
+    Args:
+        n_blocks: number of updates in the window
+        k: size parameter of the sketches
+
+    """
+
+    def __init__(self, n_blocks, k=200):
+        self.k = k
+        self.blocks = deque(maxlen=n_blocks)
+
+    def update(self, values):
+        self.blocks.append(QuantileSketch(self.k).update(values))
+        return self
+
+    def sketch(self):
+        """ QuantileSketch of all values in the window
+        """
+        merged = QuantileSketch(self.k)
+        for block in self.blocks:
+            merged.merge(block)
+        return merged
+
+    def quantile(self, q):
+        return self.sketch().quantile(q)
+
+    def percentile(self, p):
+        return self.sketch().percentile(p)
+
+
+def percentile_edges(x, n_edges):
+    """ Equal-frequency bin edges at n_edges equidistant percentiles from 0 to 100
+
+    Args:
+        x: array (exact, np.percentile), a QuantileSketch or WindowedQuantileSketch, a list of sketches (e.g. one per
+            worker, they are merged) or an iterable of chunks, which is streamed through a QuantileSketch
+        n_edges: number of edges
+
+    Returns:
+        array of edges
+
+    """
+    percentiles = np.linspace(0, 100, n_edges)
+    if isinstance(x, (QuantileSketch, WindowedQuantileSketch)):
+        return x.percentile(percentiles)
+    if isinstance(x, (list, tuple)) and len(x) and all(isinstance(s, QuantileSketch) for s in x):
+        merged = QuantileSketch(x[0].k)
+        for s in x:
+            merged.merge(s)
+        return merged.percentile(percentiles)
+    if not hasattr(x, '__len__'):
+        sketch = QuantileSketch()
+        for chunk in x:
+            sketch.update(chunk)
+        return sketch.percentile(percentiles)
+    return np.percentile(x, percentiles)
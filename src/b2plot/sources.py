@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Column sources which are read chunk by chunk.
+
+Memory-mapped arrays, pyarrow arrays and columns of Parquet files can be plotted directly. They are never loaded
+as a whole, the histogram functions fill them chunk by chunk (one row group at a time for Parquet files).
+
+Examples:
+    >>> b2plot.hist(b2plot.ParquetColumn("ntuple.parquet", "M", weights="w"), bins=100)
+    >>> b2plot.stacked("ntuple.parquet", "M", by="mcType")
+
+"""
+
+import numpy as np
+import pandas as pd
+
+# Number of entries per chunk of memory-mapped and pyarrow arrays
+CHUNK_SIZE = 2**22
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Reading Parquet files needs pyarrow, please install it with `pip install pyarrow`")
+    return pq
+
+
+class ParquetColumn:
+    """ Column of a Parquet file, read one row group at a time
+
+    Args:
+        path: Parquet file
+        column: column name
+        weights: (optional) name of the weight column
+
+    """
+
+    def __init__(self, path, column, weights=None):
+        self.path = path
+        self.column = column
+        self.weights = weights
+        self.file = _import_pyarrow().ParquetFile(path)
+
+    def __len__(self):
+        return self.file.metadata.num_rows
+
+    def chunks(self):
+        """ (values, weights) of each row group
+        """
+        columns = [self.column] if self.weights is None else [self.column, self.weights]
+        for i in range(self.file.num_row_groups):
+            table = self.file.read_row_group(i, columns=columns)
+            weights = None if self.weights is None else _to_numpy(table.column(self.weights))
+            yield _to_numpy(table.column(self.column)), weights
+
+    def min_max(self):
+        """ Smallest and largest value, from the row group statistics if they are stored
+        """
+        metadata = self.file.metadata
+        index = self.file.schema_arrow.get_field_index(self.column)
+        low, high = [], []
+        for i in range(metadata.num_row_groups):
+            stats = metadata.row_group(i).column(index).statistics
+            if stats is None or not stats.has_min_max:
+                return _chunked_min_max(values for values, _ in self.chunks())
+            low.append(stats.min)
+            high.append(stats.max)
+        if not low:
+            return np.nan, np.nan
+        return float(np.min(low)), float(np.max(high))
+
+
+def is_source(data):
+    """ Check if data is a column source which is read chunk by chunk
+    """
+    return isinstance(data, (np.memmap, ParquetColumn)) or _is_arrow(data)
+
+
+def iter_chunks(data, weights=None):
+    """ Iterate over a column source
+
+    Args:
+        data: memory-mapped array, pyarrow array or ParquetColumn
+        weights: (optional) weights of the same kind and length as data, not used for ParquetColumn
+
+    Yields:
+        (values, weights) arrays, weights is None without weights
+
+    """
+    if isinstance(data, ParquetColumn):
+        assert weights is None, "Please give the weight column to ParquetColumn"
+        for chunk in data.chunks():
+            yield chunk
+        return
+
+    assert weights is None or len(weights) == len(data), "Weights and data length does not match"
+    if _is_arrow(data):
+        offset = 0
+        for chunk in getattr(data, 'chunks', [data]):
+            w = None if weights is None else _slice(weights, offset, offset + len(chunk))
+            offset += len(chunk)
+            yield _to_numpy(chunk), w
+        return
+
+    for start in range(0, len(data), CHUNK_SIZE):
+        w = None if weights is None else _slice(weights, start, start + CHUNK_SIZE)
+        yield np.asarray(data[start:start + CHUNK_SIZE]), w
+
+
+def source_range(data):
+    """ Smallest and largest finite value of a column source
+    """
+    if isinstance(data, ParquetColumn):
+        return data.min_max()
+    return _chunked_min_max(values for values, _ in iter_chunks(data))
+
+
+def read_parquet(path, columns, chunked=False):
+    """ Read some columns of a Parquet file as DataFrame
+
+    Args:
+        path: Parquet file
+        columns: list of column names
+        chunked: return a generator with one DataFrame per row group
+
+    """
+    parquet_file = _import_pyarrow().ParquetFile(path)
+    if chunked:
+        return (parquet_file.read_row_group(i, columns=columns).to_pandas()
+                for i in range(parquet_file.num_row_groups))
+    return parquet_file.read(columns=columns).to_pandas()
+
+
+def is_parquet_path(df):
+    return isinstance(df, str) and df.endswith(('.parquet', '.parq', '.pq'))
+
+
+def _is_arrow(data):
+    return type(data).__module__.startswith('pyarrow') and hasattr(data, 'to_numpy')
+
+
+def _to_numpy(array):
+    """ pyarrow array to float ndarray, missing values become NaN
+    """
+    if hasattr(array, 'combine_chunks'):
+        array = array.combine_chunks()
+    values = array.to_numpy(zero_copy_only=False)
+    if array.null_count and values.dtype.kind != 'f':
+        values = pd.Series(values).astype(float).values
+    return values
+
+
+def _slice(array, first, last):
+    if _is_arrow(array):
+        return _to_numpy(array.slice(first, last - first)).astype(float)
+    return np.asarray(array[first:last], dtype=float)
+
+
+def _chunked_min_max(chunks):
+    low, high = np.inf, -np.inf
+    for values in chunks:
+        values = values[np.isfinite(values)]
+        if len(values):
+            low, high = min(low, values.min()), max(high, values.max())
+    if low > high:
+        return np.nan, np.nan
+    return float(low), float(high)
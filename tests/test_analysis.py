@@ -15,11 +15,96 @@ import numpy as np
 
 def test_divideEfficiency():
     t = np.ones(10)
-    res = bp.analysis.divideEfficiency(t,t)
+    res = bp.analysis.divide_efficiency(t,t)
     assert np.mean(res[0]) == 1, "braindead test"
 
 
 def test_divideEfficiency_half():
     t = np.ones(10)
-    res = bp.analysis.divideEfficiency(t, t*2)
+    res = bp.analysis.divide_efficiency(t, t*2)
     assert np.mean(res[0]) == 0.5, "should be 0.5"    
+
+
+def test_divide_efficiency_matches_exact_CI():
+    k = np.array([[0., 1., 5.], [10., 0., 3.]])
+    n = np.array([[0., 4., 10.], [10., 7., 3.]])
+    rat, (err_down, err_up) = bp.analysis.divide_efficiency(k, n)
+    assert rat.shape == k.shape
+    for idx in np.ndindex(k.shape):
+        expected = bp.analysis.exact_CI(k[idx], n[idx])
+        assert np.allclose((rat[idx], err_down[idx], err_up[idx]), expected)
+
+
+def test_divide_ratios_matches_per_bin_intervals():
+    k1, n1 = np.array([3., 5., 8.]), np.array([10., 10., 12.])
+    k2, n2 = np.array([4., 2., 8.]), np.array([10., 9., 10.])
+    rat, (err_down, err_up) = bp.analysis.divide_ratios(k1, n1, k2, n2)
+    assert np.allclose(rat, (k1/n1)/(k2/n2))
+    # intervals of the previous per bin implementation
+    assert np.allclose(err_down, [0.2862981502, 0.3163057109, 0.1475546091])
+    assert np.allclose(err_up, [0.3296931143, 0.2005010423, 0.1475546091])
+
+
+def test_purity_counts():
+    x = np.random.normal(0, 1, 10000)
+    mask = np.random.uniform(0, 1, 10000) < 0.3
+    x[::50] = np.nan
+
+    counts = bp.analysis.PurityCounts(x, mask, nbins=11)
+    finite = np.isfinite(x)
+    assert np.array_equal(counts.signal, np.histogram(x[finite & mask], counts.edges)[0])
+    assert np.array_equal(counts.background, np.histogram(x[finite & ~mask], counts.edges)[0])
+
+    # the functions accept the counts instead of x and mask
+    assert np.allclose(bp.analysis.purity_hist(counts, do_plot=False)[0], counts.purity)
+    for a, b in zip(bp.analysis.fpr_tpr(counts), bp.analysis.fpr_tpr(x, mask, nbins=11)):
+        assert np.allclose(a, b)
+
+
+def test_roc_auc():
+    x = np.random.randint(0, 20, 400).astype(float)
+    mask = np.random.uniform(0, 1, 400) < 0.4
+    w = np.random.uniform(0, 1, 400)
+
+    # all pairs, ties count half
+    pairs = (x[mask, None] > x[None, ~mask]) + 0.5 * (x[mask, None] == x[None, ~mask])
+    weighted = np.outer(w[mask], w[~mask])
+    assert np.isclose(bp.analysis.roc_auc(x, mask), pairs.mean())
+    assert np.isclose(bp.analysis.roc_auc(x, mask, w), np.sum(weighted * pairs) / np.sum(weighted))
+    assert np.isclose(bp.analysis.roc_auc(x[mask], x[~mask]), pairs.mean())
+
+    fpr, tpr, _ = bp.analysis.roc_curve(x, mask, w)
+    assert np.isclose(np.trapz(tpr, fpr), bp.analysis.roc_auc(x, mask, w))
+
+    auc, error = bp.analysis.binned_roc_auc(x, mask, w, nbins=7)
+    assert abs(auc - bp.analysis.roc_auc(x, mask, w)) <= error
+
+
+def test_rank_features():
+    import pandas as pd
+    signal = np.random.uniform(0, 1, 2000) < 0.3
+    df = pd.DataFrame({'a': np.random.normal(0, 1, 2000) + signal, 'b': np.random.normal(0, 1, 2000),
+                       'c': np.round(np.random.normal(0, 1, 2000) - 2 * signal, 1), 'signal': signal})
+
+    ranking = bp.analysis.rank_features(df, 'signal', n_threads=2)
+    assert list(ranking.index) == ['c', 'a', 'b']
+    for col in ranking.index:
+        assert np.isclose(ranking.auc[col], bp.analysis.roc_auc(df[col].values, signal))
+        assert np.isclose(ranking.flatness_proba[col], bp.analysis.purity_flatness_proba(df[col].values, signal))
+
+    # the ranking can be drawn directly
+    import matplotlib.pyplot as plt
+    order = bp.analysis.plot_feature_importance(ranking.separation)
+    assert list(order) == ['c', 'a', 'b']
+    assert len(plt.gca().patches) == 3
+    plt.close()
+
+
+def test_tail_cuts():
+    x = np.append(np.arange(1000.), [5000., 1e5])
+    step = np.std(x)
+    # 0.1% of x are two entries, the first step below 5000 is at 1e5 - 31 std, the cut is one step before
+    assert np.isclose(bp.analysis.get_upper_lim(x), 1e5 - 30 * step)
+    assert bp.analysis.get_lower_lim(x) == 0.
+    # no step reaches 50% within maxtries
+    assert np.isclose(bp.analysis.get_upper_lim(x, perc=50, maxtries=3), 1e5 - 3 * step)
@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import pytest
+import b2plot as bp
+import numpy as np
+import pandas as pd
+
+
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_render_batch(tmp_path, n_workers):
+    df = pd.DataFrame({'x': np.random.normal(0, 1, 1000), 'w': np.random.uniform(0, 1, 1000),
+                       'c': np.random.randint(0, 3, 1000)})
+    weights = df.w.values.copy()
+    jobs = [{'column': 'x', 'bins': 20, 'path': str(tmp_path / 'x.png'), 'style': {'color': 0}},
+            {'column': 'x', 'kind': 'errorhist', 'weights': 'w', 'path': str(tmp_path / 'xw.png'),
+             'style': {'color': 1}},
+            {'column': 'x', 'kind': 'stacked', 'by': 'c', 'path': str(tmp_path / 'stacked.png')},
+            {'column': 'x', 'kind': 'unknown', 'path': str(tmp_path / 'unknown.png')}]
+
+    timing = bp.render_batch(df, jobs, n_workers=n_workers)
+
+    assert [t['path'] for t in timing] == [job['path'] for job in jobs]
+    assert [t['error'] is None for t in timing] == [True, True, True, False]
+    assert all(os.path.exists(job['path']) for job in jobs[:3])
+    assert np.array_equal(df.w.values, weights)
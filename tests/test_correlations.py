@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import binned_statistic_2d
+
+from b2plot import correlations, QuantileSketch
+
+
+def test_flat_counts():
+    x = np.random.normal(0, 1, 5000)
+    y = np.round(x + np.random.normal(0, 1, 5000))
+
+    x_codes, nx = correlations.flat_digitize(x, 10)
+    y_codes, ny = correlations.flat_digitize(y, 10)
+    edges = [pd.unique(np.percentile(v, np.linspace(0, 100, 10))) for v in (x, y)]
+    expected = binned_statistic_2d(x, y, values=x, statistic='count', bins=edges).statistic.T
+    assert np.array_equal(correlations.flat_counts(x_codes, nx, y_codes, ny), expected)
+
+    # the stacked evaluation of the matrix equals the single maps
+    codes = [(x_codes, nx), (y_codes, ny)]
+    significance, _ = correlations.flat_corr_significance(codes, len(x), 10)
+    for i in range(2):
+        for j in range(2):
+            single, _ = correlations.flat_significance(correlations.flat_counts(*codes[j], *codes[i]), len(x), 10)
+            assert np.allclose(significance[i][j], single, equal_nan=True)
+
+
+def test_flat_corr_tensor():
+    df = pd.DataFrame({'a': np.random.normal(0, 1, 2000), 'b': np.random.exponential(1, 2000),
+                       'c': np.random.randint(0, 4, 2000).astype(float)})
+    significance, proba = correlations.flat_corr_tensor(df, nbins=8, n_threads=2)
+    assert significance.shape == (3, 3, 7, 7)
+    assert np.allclose(proba, proba.T)
+
+    for i in range(3):
+        for j in range(3):
+            x_codes, nx = correlations.flat_digitize(df.iloc[:, j], 8)
+            y_codes, ny = correlations.flat_digitize(df.iloc[:, i], 8)
+            single, p = correlations.flat_significance(correlations.flat_counts(x_codes, nx, y_codes, ny), 2000, 8)
+            assert np.allclose(significance[i, j, :ny, :nx], single, equal_nan=True)
+            assert np.isclose(proba[i, j], p)
+            # columns with ties have fewer bins, the rest is padded
+            assert np.isnan(significance[i, j, ny:]).all() and np.isnan(significance[i, j, :, nx:]).all()
+
+
+def test_flat_corr_matrix_single_image():
+    import matplotlib.pyplot as plt
+    df = pd.DataFrame(np.random.normal(0, 1, (1000, 3)), columns=['a', 'b', 'c'])
+    correlations.flat_corr_matrix(df, single_image=True, label_size=6, n_threads=2)
+    fig = plt.gcf()
+    assert len(fig.axes) == 1 and len(fig.axes[0].images) == 1
+
+    significance, _ = correlations.flat_corr_tensor(df)
+    size = significance.shape[-1]
+    image = fig.axes[0].images[0].get_array()
+    assert image.shape == (3 * size, 3 * size)
+    assert np.allclose(image[size:2 * size, :size].filled(np.nan), significance[1, 0], equal_nan=True)
+    plt.close(fig)
+
+    correlations.flat_corr_matrix(df, n_threads=2)
+    fig = plt.gcf()
+    assert len(fig.axes) == 9
+    assert np.allclose(fig.axes[3].images[0].get_array(), significance[1, 0])
+    plt.close(fig)
+
+
+def test_corrplot_markers():
+    import matplotlib.pyplot as plt
+    corr = pd.DataFrame(np.random.normal(0, 1, (200, 4)), columns=list('abcd')).corr()
+    plt.figure()
+    correlations.corrplot(corr, palette=['#ff0000', '#ffffff', '#00ff00'], size_scale=100)
+    markers = plt.gcf().axes[0].collections[0]
+
+    # column by column, the first one is drawn at y = 3 as y_order is reversed
+    values = corr.values.T.ravel()
+    assert np.array_equal(markers.get_offsets()[:4], [[0, 3], [1, 3], [2, 3], [3, 3]])
+    assert np.allclose(markers.get_sizes(), (np.abs(values) * 0.99 + 0.01) * 100)
+    assert np.allclose(markers.get_facecolors()[values == 1], [0, 1, 0, 1])
+    plt.close('all')
+
+
+def test_correlation_matrix():
+    x = np.random.normal(0, 1, (20000, 3))
+    df = pd.DataFrame({'a': x[:, 0] + 100, 'b': x[:, 0] + x[:, 1], 'c': np.exp(x[:, 0]) + x[:, 2]})
+    df.loc[::7, 'b'] = np.nan
+    chunks = [df.iloc[i:i + 3000] for i in range(0, len(df), 3000)]
+
+    pearson = correlations.correlation_matrix(iter(chunks))
+    assert np.allclose(pearson.values, df.corr().values)
+    spearman = correlations.correlation_matrix(iter(chunks), 'spearman', nbins=128)
+    assert np.allclose(spearman.values, df.corr('spearman').values, atol=1e-3)
+
+    # integer weights are the same as repeated entries
+    w = np.random.randint(1, 4, len(df))
+    repeated = df.loc[df.index.repeat(w)]
+    assert np.allclose(correlations.correlation_matrix(df, weights=w).values, repeated.corr().values)
+
+    # accumulators of different chunks can be added
+    acc = correlations.CorrelationAccumulator().fill(chunks[0])
+    acc += correlations.CorrelationAccumulator().fill(chunks[1:])
+    assert np.allclose(acc.corr().values, pearson.values)
+
+
+def test_spearman_weights_and_edges():
+    x = np.random.normal(0, 1, (20000, 3))
+    df = pd.DataFrame({'a': x[:, 0], 'b': x[:, 0] + x[:, 1], 'c': x[:, 0] + 0.5 * x[:, 2]})
+
+    # integer weights are the same as repeated entries, up to the binning
+    w = np.random.randint(1, 4, len(df))
+    repeated = df.loc[df.index.repeat(w)]
+    spearman = correlations.correlation_matrix(df, 'spearman', weights=w, nbins=128)
+    assert np.allclose(spearman.values, repeated.corr('spearman').values, atol=1e-3)
+
+    # the edges of the first of the sorted chunks do not cover the data
+    chunks = [df.sort_values('a').iloc[i:i + 2500] for i in range(0, len(df), 2500)]
+    with pytest.warns(UserWarning, match="do not cover"):
+        correlations.correlation_matrix(iter(chunks), 'spearman')
+
+    sketches = [QuantileSketch() for _ in df.columns]
+    for chunk in chunks:
+        for sketch, column in zip(sketches, df.columns):
+            sketch.update(chunk[column].values)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        spearman = correlations.correlation_matrix(iter(chunks), 'spearman', nbins=128, edges=sketches)
+    assert np.allclose(spearman.values, df.corr('spearman').values, atol=5e-3)
+
+    # columns without values or with a single value are NaN, as in DataFrame.corr
+    df['n'], df['k'] = np.nan, 1.
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        for method in ('pearson', 'spearman'):
+            matrix = correlations.correlation_matrix(df, method).values
+            assert np.array_equal(np.isnan(matrix), np.isnan(df.corr(method).values))
@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+import b2plot as bp
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+
+
+def test_accumulator_chunks():
+    data = np.random.normal(0, 1, 10000)
+    weights = np.random.uniform(0, 2, 10000)
+    edges = np.linspace(-3, 3, 31)
+
+    acc = bp.HistAccumulator(edges)
+    acc.fill((data[i:i + 1000], weights[i:i + 1000]) for i in range(0, len(data), 1000))
+
+    assert np.allclose(acc.sumw, np.histogram(data, edges, weights=weights)[0])
+    assert np.allclose(acc.sumw2, np.histogram(data, edges, weights=weights**2)[0])
+    assert acc.entries == len(data)
+
+
+def test_hist_from_accumulator(monkeypatch):
+    bp.nf()
+    df = pd.DataFrame({'x': np.random.normal(0, 1, 5000)})
+    edges = np.linspace(-3, 3, 31)
+
+    acc = bp.HistAccumulator(edges).fill(np.array_split(df, 5), column='x')
+    y, xaxis, _ = bp.hist(acc, color=0)
+
+    assert np.allclose(y, np.histogram(df.x, edges)[0])
+    assert np.allclose(xaxis, edges)
+
+    # the contents are drawn without binning them again
+    weights = np.random.uniform(0, 2, len(df))
+    acc = bp.HistAccumulator(edges).fill(df.x.values, weights)
+    monkeypatch.setattr(bp.cache, "fill", None)
+    assert np.allclose(bp.hist(acc, color=0)[0], acc.sumw)
+    y, _, _, err = bp.errorhist(acc, uncertainty_mode="sumw2", scale=2., color=0)
+    assert np.allclose(y, 2 * acc.sumw)
+    assert np.allclose(err, 2 * np.sqrt(acc.sumw2))
+    plt.close()
+
+
+def test_fill_single_pass():
+    data = np.append(np.random.normal(0, 1, 1000), [np.nan, 3., -10., 10.])
+    weights = np.random.uniform(0, 2, len(data))
+    edges = np.linspace(-3, 3, 13)
+
+    sumw, sumw2, counts = bp.binning.fill(data, edges, weights)
+
+    assert np.allclose(sumw, np.histogram(data, edges, weights=weights)[0])
+    assert np.allclose(sumw2, np.histogram(data, edges, weights=weights**2)[0])
+    assert np.array_equal(counts, np.histogram(data, edges)[0])
+
+
+def test_errorhist_sumw2():
+    bp.nf()
+    data = np.random.normal(0, 1, 1000)
+    weights = np.random.uniform(0, 2, 1000)
+    edges = np.linspace(-3, 3, 13)
+
+    y, _, _, err = bp.errorhist(data, edges, weights=weights, uncertainty_mode="sumw2", color=0)
+
+    assert np.allclose(err, np.sqrt(np.histogram(data, edges, weights=weights**2)[0]))
+    plt.close()
+
+
+@pytest.mark.parametrize("edges", [np.linspace(-3, 3, 101), np.arange(-3, 3.01, 0.06), np.linspace(1e6, 1e6 + 1, 51),
+                                   np.sort(np.random.normal(0, 1, 40))])
+def test_fill_matches_np_histogram_at_edges(edges):
+    data = np.concatenate([edges, np.nextafter(edges, np.inf), np.nextafter(edges, -np.inf),
+                           [np.inf, -np.inf, np.nan], np.random.uniform(-5, 5, 10000)])
+    weights = np.random.uniform(0, 2, len(data))
+    finite = np.isfinite(data)
+
+    sumw, _, counts = bp.binning.fill(data, edges, weights)
+
+    assert np.array_equal(counts, np.histogram(data[finite], edges)[0])
+    assert np.allclose(sumw, np.histogram(data[finite], edges, weights=weights[finite])[0])
+    assert np.array_equal(bp.binning.fill(data, edges)[2], counts)
+
+
+def test_fill_threads(monkeypatch):
+    monkeypatch.setattr(bp.binning, "MIN_PARALLEL_ENTRIES", 0)
+    data = np.random.normal(0, 1, 5 * bp.binning.BLOCK_SIZE + 123)
+    weights = np.random.uniform(0, 2, len(data))
+    edges = np.linspace(-3, 3, 31)
+
+    serial = bp.binning.fill(data, edges, weights)
+    parallel = bp.binning.fill(data, edges, weights, n_threads=4)
+
+    for s, p in zip(serial, parallel):
+        assert np.allclose(s, p)
+
+    bp.nf()
+    y, _, _ = bp.hist(data, edges, weights=weights, n_threads=4)
+    y_err, _, _, _ = bp.errorhist(data, edges, weights=weights, n_threads=4)
+    assert np.allclose(y, serial[0])
+    assert np.allclose(y_err, serial[0])
+    plt.close()
+
+
+def test_stacked_one_pass_matches_to_stack():
+    df = pd.DataFrame({'x': np.random.normal(0, 1, 3000), 'c': np.random.randint(0, 4, 3000),
+                       'w': np.random.uniform(0, 1, 3000)})
+    edges = np.linspace(-3, 3, 31)
+
+    bp.nf()
+    y, _, _ = bp.stacked(df, 'x', 'c', bins=edges, weights='w')
+    data, weights = bp.to_stack(df, 'x', 'c', stack_weights='w')
+
+    assert np.allclose(y, np.histogram(np.concatenate(data), edges, weights=np.concatenate(weights))[0])
+    plt.close()
+
+
+def test_hist_from_counts():
+    data = np.random.normal(0, 1, 1000)
+    counts, edges = np.histogram(data, 20)
+
+    plt.figure()
+    y, xaxis, patches = bp.hist_from_counts(counts, edges, color=0)
+    assert np.array_equal(y, counts)
+    assert np.array_equal(xaxis, edges)
+
+    y, _, _ = bp.hist_from_counts(counts, edges, density=True, color=0)
+    assert np.allclose(y, np.histogram(data, edges, density=True)[0])
+
+    tops, _, patches = bp.stacked_from_counts([counts, counts], edges)
+    assert np.array_equal(tops[-1], 2 * counts)
+    assert len(patches) == 2
+    plt.close()
+
+
+def test_stairs_without_matplotlib_stairs():
+    class OldAxes:
+        """ axes of matplotlib < 3.4, without stairs """
+        def __init__(self, ax):
+            self.hist = ax.hist
+
+    counts, edges = np.array([1., 3., 2.]), np.array([0., 1., 2., 4.])
+    ax = plt.figure().gca()
+    step = bp.histogram._stairs(OldAxes(ax), counts, edges)
+    filled = bp.histogram._stairs(OldAxes(ax), counts + 1, edges, baseline=np.ones(3), fill=True)
+
+    assert np.allclose(step.get_xy()[:, 1].max(), 3)
+    assert np.allclose(filled.get_xy()[:, 1].min(), 1)
+    assert np.allclose(filled.get_xy()[:, 1].max(), 4)
+    plt.close()
+
+
+def test_cache(tmp_path):
+    data = np.random.normal(0, 1, 10000)
+    edges = np.linspace(-3, 3, 31)
+
+    bp.enable_cache(str(tmp_path))
+    try:
+        plt.figure()
+        y1, _, _ = bp.hist(data, edges, color=0)
+        y2, _, _ = bp.hist(data, edges, color=1)
+        assert np.array_equal(y1, y2)
+        assert bp.cache_info()['hits'] == 1
+        assert bp.cache_info()['misses'] == 1
+
+        # the scale is applied after the lookup
+        y3, _, _ = bp.hist(data, edges, scale=2., color=0)
+        assert np.array_equal(y3, 2 * y1)
+        assert bp.cache_info()['hits'] == 2
+
+        bp.hist(data, edges, weights=np.ones(len(data)), color=0)
+        assert bp.cache_info()['misses'] == 2
+
+        bp.cache.MAX_SIZE = 0
+        bp.hist(data + 1, edges, color=0)
+        assert bp.cache_info()['entries'] == 0
+        plt.close()
+    finally:
+        bp.cache.clear_cache()
+        bp.cache.MAX_SIZE = 2**28
+        bp.disable_cache()
+
+
+def test_fingerprint_with_nan():
+    data = np.random.normal(0, 1, 100000)
+    data[::10] = np.nan
+    weights = np.random.uniform(0, 1, len(data))
+    codes = np.random.randint(0, 3, len(data))
+    edges = np.linspace(-3, 3, 31)
+
+    # the change is outside of the sampled stride
+    other = data.copy()
+    other[1] += 1
+    for w, c in [(None, None), (weights, None), (None, codes)]:
+        assert bp.cache.fingerprint(data, edges, w, c) == bp.cache.fingerprint(data.copy(), edges, w, c)
+        assert bp.cache.fingerprint(data, edges, w, c) != bp.cache.fingerprint(other, edges, w, c)
+
+
+def test_deferred_rendering():
+    data = np.random.normal(0, 1, 1000)
+
+    bp.figure()
+    bp.defer()
+    try:
+        y, xaxis, patches = bp.hist(data, 20, color=0)
+        bp.errorhist(data, color=1)
+        assert patches is None
+        assert len(plt.gca().patches) == 0
+    finally:
+        bp.defer(False)
+
+    drawn = bp.render()
+    assert np.array_equal(drawn[0][0], y)
+    assert len(plt.gca().patches) == 1
+
+    plt.figure()
+    bp.render(ax=plt.gca(), lw=3)
+    assert plt.gca().patches[0].get_linewidth() == 3
+    plt.close('all')
+
+
+def test_binning_per_axes():
+    from concurrent.futures import ThreadPoolExecutor
+    from matplotlib.figure import Figure
+
+    data = np.random.normal(0, 1, 10000)
+
+    f, (ax1, ax2) = plt.subplots(1, 2)
+    _, xaxis1, _ = bp.hist(data, 10, ax=ax1, color=0)
+    _, xaxis2, _ = bp.hist(data, 30, ax=ax2, color=0)
+    assert np.array_equal(bp.hist(data, ax=ax1, color=0)[1], xaxis1)
+    assert np.array_equal(bp.errorhist(data, ax=ax2, color=0)[1], xaxis2)
+    plt.close(f)
+
+    def plot(nbins):
+        ax = Figure().subplots()
+        for _ in range(5):
+            _, xaxis, _ = bp.hist(data, ax=ax, color=0) if len(ax.patches) else bp.hist(data, nbins, ax=ax, color=0)
+            assert len(xaxis) == nbins + 1
+        return bp.helpers.xaxis(ax)
+
+    with ThreadPoolExecutor(4) as pool:
+        edges = list(pool.map(plot, [5, 10, 15, 20] * 4))
+    assert [len(e) - 1 for e in edges] == [5, 10, 15, 20] * 4
+
+
+def test_set_xaxis_after_hist():
+    data = np.random.normal(0, 1, 1000)
+
+    bp.nf()
+    bp.hist(data, 10, color=0)
+    bp.set_xaxis(np.linspace(-1, 1, 5))
+    assert len(bp.hist(data, color=0)[1]) == 5
+
+    # the binning of the previous axes is not used for new ones
+    f, (ax1, ax2) = plt.subplots(1, 2)
+    assert bp.helpers.xaxis(ax1) is None
+    assert len(bp.hist(data, ax=ax2, color=0)[1]) != 5
+    plt.close('all')
+
+    # looking up the binning does not create axes
+    bp.HistAccumulator(np.linspace(-1, 1, 5))
+    bp.set_xaxis(np.linspace(-1, 1, 3))
+    assert len(bp.HistAccumulator().edges) == 3
+    assert not plt.get_fignums()
+    bp.set_xaxis(None)
+
+
+def test_column_sources(tmp_path, monkeypatch):
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+
+    df = pd.DataFrame({'x': np.random.normal(0, 1, 10000), 'w': np.random.uniform(0, 2, 10000),
+                       'c': np.random.randint(0, 3, 10000)})
+    df.loc[::100, 'x'] = np.nan
+    path = str(tmp_path / 'sample.parquet')
+    pq.write_table(pa.Table.from_pandas(df), path, row_group_size=1000)
+    edges = np.linspace(-3, 3, 31)
+    expected = np.histogram(df.x, edges, weights=df.w)[0]
+
+    memmap = np.memmap(str(tmp_path / 'x.dat'), dtype=float, mode='w+', shape=len(df))
+    memmap[:] = df.x.values
+
+    plt.figure()
+    for data, weights in [(memmap, df.w.values), (pa.chunked_array([df.x[:5000], df.x[5000:]]), pa.array(df.w)),
+                          (bp.ParquetColumn(path, 'x', weights='w'), None)]:
+        y, xaxis, _ = bp.hist(data, edges, weights=weights, color=0)
+        assert np.allclose(y, expected)
+
+    # explicit edges or a range are used without scanning the column
+    monkeypatch.setattr(bp.histogram, "source_range", None)
+    assert np.allclose(bp.hist(memmap, edges, color=0)[1], edges)
+    assert np.allclose(bp.hist(memmap, 30, range=(-3, 3), color=0)[1], edges)
+    monkeypatch.undo()
+
+    # the binning of a source without bins matches the one of the full array
+    _, xaxis, _ = bp.hist(bp.ParquetColumn(path, 'x'), 20, color=0)
+    assert np.allclose(xaxis, np.histogram_bin_edges(df.x.dropna(), 20))
+
+    y, _, _ = bp.stacked(path, 'x', 'c', bins=edges, weights='w')
+    y_df, _, _ = bp.stacked(df, 'x', 'c', bins=edges, weights='w')
+    assert np.allclose(y, y_df)
+    plt.close()
+
+
+def test_remove_nans_without_copy():
+    data = np.random.normal(0, 1, 1000)
+    weights = np.random.uniform(0, 1, 1000)
+    original_weights = weights.copy()
+    clean, clean_weights = bp.functions.remove_nans(data, weights)
+    assert clean is data and clean_weights is weights
+
+    data[::10] = np.nan
+    clean, clean_weights = bp.functions.remove_nans(data, weights)
+    assert np.array_equal(clean, data[~np.isnan(data)])
+    assert np.array_equal(clean_weights, weights[~np.isnan(data)])
+
+    plt.figure()
+    y, xaxis, _ = bp.hist(data, 20, weights=weights, scale=2., color=0)
+    assert np.allclose(y, np.histogram(clean, xaxis, weights=2 * clean_weights)[0])
+    assert np.array_equal(weights, original_weights)
+    plt.close()
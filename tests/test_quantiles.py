@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+import b2plot as bp
+import numpy as np
+from b2plot.quantiles import percentile_edges
+
+
+def test_sketch_exact_for_small_samples():
+    x = np.random.normal(0, 1, 100)
+    sketch = bp.QuantileSketch().update(x)
+    assert np.allclose(percentile_edges(sketch, 11), np.percentile(x, np.linspace(0, 100, 11)))
+    assert sketch.rank_error() == 0
+
+
+@pytest.mark.parametrize("k", [200, 1000])
+def test_sketch_rank_error(k):
+    x = np.random.RandomState(0).exponential(1, 10**6)
+    x[::1000] = np.nan
+    chunks = np.array_split(x, 40)
+
+    sketch = bp.QuantileSketch(k, seed=1)
+    for chunk in chunks[:20]:
+        sketch.update(chunk)
+    # the second half is filled on a "worker" and merged
+    other = bp.QuantileSketch(k, seed=2)
+    for chunk in chunks[20:]:
+        other.update(chunk)
+    sketch.merge(other)
+
+    clean = np.sort(x[~np.isnan(x)])
+    assert len(sketch) == len(clean)
+    q = np.linspace(0.01, 0.99, 99)
+    ranks = np.searchsorted(clean, sketch.quantile(q)) / len(clean)
+    assert np.max(np.abs(ranks - q)) < sketch.rank_error()
+    assert sum(len(level) for level in sketch.levels) < 4 * k
+
+
+def test_windowed_sketch():
+    sketch = bp.WindowedQuantileSketch(2)
+    for shift in range(5):
+        sketch.update(np.random.normal(shift, 1, 1000))
+    assert len(sketch.sketch()) == 2000
+    assert 3 < sketch.quantile(0.5) < 4